@@ -2,23 +2,32 @@
 
 from COPASI import *
 import numpy as np
+from telemetry import Stage
 
 
 class CopasiSimulator:
     def __init__(self, sbmlfile):
+        self.sbmlfile = sbmlfile
         CCopasiRootContainer.init()
         self.dataModel = CCopasiRootContainer.addDatamodel()
         assert CCopasiRootContainer.getDatamodelList().size() == 1
-        try:
-            self.dataModel.importSBML(sbmlfile)
-        except:
-            raise IOError("Error while importing model from file \"" + sbmlfile + "\".")
+        with Stage("import", sbmlfile):
+            try:
+                self.dataModel.importSBML(sbmlfile)
+            except:
+                raise IOError("Error while importing model from file \"" + sbmlfile + "\".")
         self.model = self.dataModel.getModel()
 
 #    def reInitialize(self): # this should be in here somehow
 #        pass
 
-#TODO: also have get, not only set
+    def getParameter(self, names):
+        values = {}
+        for i in range(self.model.getModelValues().size()):
+            metab = self.model.getModelValue(i)
+            if metab.getObjectName() in names:
+                values[metab.getObjectName()] = metab.getInitialValue()
+        return values
 
     def setParameter(self, initDict): #TODO: to be replaced by setInit(conc, params, localParams)
         metabs = {}
@@ -41,6 +50,14 @@ class CopasiSimulator:
 # r.getParameter(i)
         pass
 
+    def getInitialConcentration(self, names):
+        values = {}
+        for i in range(self.model.getMetabolites().size()):
+            metab = self.model.getMetabolite(i)
+            if metab.getObjectName() in names:
+                values[metab.getObjectName()] = metab.getInitialConcentration()
+        return values
+
     def setInitialConcentration(self, initDict):
         metabs = {}
         for i in range(self.model.getMetabolites().size()):
@@ -78,11 +95,12 @@ class CopasiSimulator:
         parameter.setValue(1e-12)
 
         # run simulation
-        try:
-            if trajectoryTask.process(True) == False:# or timeSeries.getRecordedSteps() != steps+1:
-                raise AssertionError
-        except:
-            raise RuntimeError("Error running the simulation")
+        with Stage("simulate", self.sbmlfile, end=end, steps=steps):
+            try:
+                if trajectoryTask.process(True) == False:# or timeSeries.getRecordedSteps() != steps+1:
+                    raise AssertionError
+            except:
+                raise RuntimeError("Error running the simulation")
 
         # return numpy array with data
         timeSeries = trajectoryTask.getTimeSeries()
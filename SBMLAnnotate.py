@@ -1,19 +1,262 @@
 #!/usr/bin/env python2.7
+"""
+Usage: ./SBMLAnnotate.py <infile> <speciesFile> <modificationFile> <outfile>
+       ./SBMLAnnotate.py -batch [-j <n>] [-outdir <dir>] <speciesFile> <modificationFile> <file|dir> ...
+    -batch  : annotate all SBML files given, and all *.xml files in the directories given,
+              loading the knowledge base only once
+    -j      : number of processes to annotate the files with, default 1
+    -outdir : directory to save the annotated files in, default is to overwrite them
+
+Examples:
+    ./SBMLAnnotate.py model.xml annotateSpecies.txt annotateModifications.txt model.xml
+    Annotates the species and reactions of model.xml in place.
+
+    ./SBMLAnnotate.py -batch -j 4 -outdir annotated annotateSpecies.txt annotateModifications.txt Bungay2003 Hockin2002
+    Annotates all SBML files in both directories with 4 processes and saves them in annotated/.
+    The species that could not be annotated are listed per model at the end.
+"""
 
-from numpy import loadtxt, dtype
 from libsbml import *
-from copy import deepcopy
+from SBMLFormat import writeSBML
+from multiprocessing import Pool
+import sys
+import os
+import glob
 import re
+import hashlib
+import tempfile
+import cPickle as pickle
+from telemetry import Stage, warn
+
+
+def combineQualifiers(q1, q2):
+    """
+    combines 2 qualifiers to yield a third one
+    """
+    if q1 == "is":
+        return q2
+    elif q2 == "is":
+        return q1
+    elif q1 == q2:
+        return q1
+    elif (q1 == "is" and q2 == "hasPart") or (q1 == "hasPart" and q2 == "is"):
+        return "hasPart"
+    elif (q1 == "isVersionOf" and q2 == "hasPart") or (q1 == "hasPart" and q2 == "isVersionOf"):
+        return "hasPart"
+    else:
+        warn("can't combine qualifiers:", q1, q2)
+
+
+class KnowledgeBase:
+    """
+    Species and modification annotations with all references resolved and the annotations
+    derived by the modification rules indexed by canonical name. The result is cached in a
+    file next to the species file and only compiled again if one of the source files changed.
+
+    Takes:
+    specFile -- the species annotation file
+    modFile -- the modification/reaction annotation file
+    cache -- file name of the compiled knowledge base, default is specFile + ".kb"
+    """
+    magic = "SBMLAnnotateKB"
+    version = 1
+
+    def __init__(self, specFile, modFile, cache=None):
+        # maximum number of modifications applied to derive an annotation
+        self.maxRuleDepth = 10
+        self.key = self.hash(specFile, modFile)
+        if cache == None:
+            cache = specFile + ".kb"
+
+        if not self.load(cache):
+            self.compile(specFile, modFile)
+            try:
+                self.save(cache)
+            except (IOError, OSError), e:
+                warn("Could not save knowledge base:", e)
+
+        self.rules = self._compileRules(self.modAnn)
+        self.identities = [(re.compile(expr), sub) for expr, sub in self.idAnn]
+        self.canonicalNames = {}
+
+    def hash(self, *fnames):
+        """ Returns the hash of the contents of all files given """
+        sha = hashlib.sha1("%s %d" % (self.magic, self.version))
+        for fname in fnames:
+            sha.update(open(fname, "rb").read())
+        return sha.hexdigest()
+
+    def load(self, fname):
+        """ Loads the knowledge base from a file, returns False if missing or outdated """
+        try:
+            header, key, self.specAnn, self.modAnn, self.idAnn, self.annIndex = \
+                pickle.load(open(fname, "rb"))
+        except Exception:
+            return False
+        return header == (self.magic, self.version) and key == self.key
+
+    def save(self, fname):
+        """ Saves the knowledge base to a file, which processes that start at the same time may share """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fname)))
+        os.fdopen(fd, "wb").write(pickle.dumps(((self.magic, self.version), self.key, self.specAnn, \
+            self.modAnn, self.idAnn, self.annIndex), pickle.HIGHEST_PROTOCOL))
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0666 & ~umask) # mkstemp creates the file readable by the owner only
+        os.rename(tmp, fname) # concurrent runs store the same knowledge base
+
+    def compile(self, specFile, modFile):
+        """
+        parses both annotation files, resolves the references between species and
+        applies the modification rules to derive the annotations of all known names
+        """
+        self.specAnn = self._loadSpeciesFile(specFile)
+        self.modAnn, self.idAnn = self._loadModificationFile(modFile)
+        self.identities = [(re.compile(expr), sub) for expr, sub in self.idAnn]
+        self.canonicalNames = {}
+
+        # canonical name -> list of [qualifier, urn]
+        self.annIndex = {}
+        modSpecAnn = self._complementAnnotationList(self.specAnn, self._compileRules(self.modAnn))
+        for name, qual, urn in sorted(modSpecAnn):
+            self.annIndex.setdefault(self.canonicalName(name), []).append([qual, urn])
+
+    def getAnnotations(self, name):
+        """
+        returns the list of [qualifier, urn] that annotate a name given the identity rules
+        """
+        return list(self.annIndex.get(self.canonicalName(name), []))
+
+    def canonicalName(self, name):
+        """
+        applies the compiled identity rules to a name until it does not change anymore,
+        so that all names equal given the identity rules have the same canonical name
+        """
+        if name not in self.canonicalNames:
+            canonical, seen = name, set()
+            while canonical not in seen:
+                seen.add(canonical)
+                for pattern, sub in self.identities:
+                    canonical = pattern.sub(sub, canonical)
+            self.canonicalNames[name] = canonical
+        return self.canonicalNames[name]
+
+    def _compileRules(self, modAnn):
+        """
+        precompiles the patterns of the modification rules
+        returns a list of (pattern, product, reaction type, list of added urns,
+            reaction qualifier, reaction urn, reaction SBO term)
+        """
+        rules = []
+        for line in modAnn:
+            reactant, product, type, qualifier, urn, sbo = line[0:6]
+            type = type.split(";")
+            rules.append((re.compile(reactant), product, type[0], type[1:], qualifier, urn, sbo))
+        return rules
+
+    def _complementAnnotationList(self, specAnn, rules):
+        """
+        takes the speciesAnnotation list and applies the compiled modification rules to it,
+        also to annotations derived before, until no new ones are found
+        returns the resulting set of (name, qualifier, urn)
+        """
+        result = set(tuple(sa) for sa in specAnn)
+        new = set(result)
+        for depth in range(self.maxRuleDepth):
+            derived = set()
+            for name, qual, urn in new:
+                for pattern, product, type, parts in [rule[0:4] for rule in rules]:
+                    match = pattern.search(name)
+                    if not match or match.group(0) != name:
+                        continue
+                    newName = pattern.sub(product, name)
+                    if type == "modification":
+                        newQual = combineQualifiers(qual, "isVersionOf")
+                        if newQual != None:
+                            derived.add((newName, newQual, urn))
+                    elif type == "addition":
+                        derived.add((newName, "hasPart", urn))
+                        for part in parts:
+                            derived.add((newName, "hasPart", part))
+                    elif type == "transport":
+                        derived.add((newName, qual, urn)) # for now, don't annotate transports
+            new = derived - result
+            if not new:
+                break
+            result |= new
+        else:
+            warn("Modification rules still derive new annotations after", depth + 1, "steps")
+        return result
+
+    def _readTable(self, fname, columns):
+        """
+        reads the whitespace separated columns of a file, skipping comments after a #
+        """
+        rows = []
+        for num, line in enumerate(open(fname)):
+            fields = line.split("#", 1)[0].split()
+            if len(fields) == columns:
+                rows.append(fields)
+            elif fields:
+                warn("Skipping line", num + 1, "of", fname, "with", len(fields), \
+                    "instead of", columns, "columns")
+        return rows
+
+    def _loadSpeciesFile(self, fname):
+        """
+        parses the species annotation file into a list object, where references to other
+        species are replaced by their annotations with the qualifiers combined
+        """
+        refs = {}
+        for id, qualifier, uri in self._readTable(fname, 3):
+            refs.setdefault(id, []).append((qualifier, uri))
+        resolved = {}
+
+        def resolve(id, visiting):
+            if id not in resolved:
+                visiting.add(id)
+                terms = []
+                for qualifier, uri in refs[id]:
+                    if uri not in refs:
+                        terms.append((qualifier, uri))
+                    elif uri not in visiting:
+                        for refQualifier, refUri in resolve(uri, visiting):
+                            newQualifier = combineQualifiers(qualifier, refQualifier)
+                            if newQualifier != None:
+                                terms.append((newQualifier, refUri))
+                resolved[id] = terms
+                visiting.discard(id)
+            return resolved[id]
+
+        speciesAnn = []
+        for id in refs:
+            for qualifier, uri in resolve(id, set()):
+                speciesAnn.append([id, qualifier, uri])
+        return speciesAnn
+
+    def _loadModificationFile(self, fname):
+        """
+        parses the mod/reaction annotation file into a list object
+        """
+        mods, ids = [], []
+        for line in self._readTable(fname, 6):
+            if line[2] == "identity":
+                ids.append(line[0:2])
+            else:
+                mods.append(line)
+        return mods, ids
 
 
 class SBMLAnnotate:
-    def __init__(self, filename):
+    def __init__(self, filename=None, verbose=True, doc=None):
         """
-        loads sbml file, sets up some class variables
+        loads sbml file, or uses the sbml document given, sets up some class variables
         """
-        self.doc = SBMLReader().readSBMLFromFile(filename)
+        self.doc = doc if doc is not None else SBMLReader().readSBMLFromFile(filename)
         self.model = self.doc.getModel()
-        self.complexSeparator = "_"
+        self.verbose = verbose
+        # names of the species that could not be annotated
+        self.unannotated = []
 
         # CV types:
         self.parser = RDFAnnotationParser()
@@ -30,28 +273,11 @@ class SBMLAnnotate:
         """
         return doc, model
 
-    def save(self, filename):
-        """
-        saves the sbml file to filename
+    def save(self, filename, indent=2, wrap=95):
         """
-        writeSBMLToFile(self.doc, filename)
-
-    def _combineQualifiers(self, q1, q2):
+        saves the sbml file to filename, indented and wrapped at the given width
         """
-        combines 2 qualifiers to yield a third one
-        """
-        if q1 == "is":
-            return q2
-        elif q2 == "is":
-            return q1
-        elif q1 == q2:
-            return q1
-        elif (q1 == "is" and q2 == "hasPart") or (q1 == "hasPart" and q2 == "is"):
-            return "hasPart"
-        elif (q1 == "isVersionOf" and q2 == "hasPart") or (q1 == "hasPart" and q2 == "isVersionOf"):
-            return "hasPart"
-        else:
-            print "WARN: can't combine qualifiers:", q1, q2
+        writeSBML(self.doc, filename, indent, wrap)
 
     def _modifyQualifier(self, q):
         """
@@ -62,45 +288,95 @@ class SBMLAnnotate:
         if q == "hasPart":
             return "hasVersion"
         else:
-            print "WARN: no modification for qualifier:", q
+            warn("no modification for qualifier:", q)
 
     def annotateSpecies(self, specFile, modFile, complex=None):
         """
         main annotation method
         """
-        specAnn = self._loadSpeciesFile(specFile)
-        modAnn, idAnn = self._loadModificationFile(modFile)
-        modSpecAnn = self._complementAnnotationList(specAnn, modAnn)
-
-        def getMatchingTuples(sname):
-            matches = []
-            for ann in modSpecAnn:
-                name, qual, urn = ann
-                if self._equalsWithIdentities(idAnn, name, sname):
-                    matches.append([qual, urn])
-            return matches
+        self.annotate(KnowledgeBase(specFile, modFile), complex)
 
+    def annotate(self, kb, complex=None):
+        """
+        annotates species and reactions using a compiled knowledge base
+        """
         # annotate complexes and identities simultaneously (to not get n! annotations)
         for species in self.model.getListOfSpecies():
             sname = species.getName()
-            matches = getMatchingTuples(sname)
+            matches = kb.getAnnotations(sname)
             if complex in sname:
                 subnames = sname.split(complex)
                 for name in subnames:
-                    for match in getMatchingTuples(name):
+                    for match in kb.getAnnotations(name):
                         if match[1] not in [m[1] for m in matches]: # only if not annotated already w/ the same urn
                             matches.append(["hasPart"] + [match[1]])
             self._setCVTerms(species, matches)
 
-        self.annotateReactions(modAnn)
+        self.annotateReactions(kb, complex)
 
-    def annotateReactions(self, annList):
+    def annotateReactions(self, kb, complex=None):
         """
-        annotates reactions using the annotation list from the mod/reaction file
+        annotates reactions using the compiled rules of a knowledge base, splitting the
+        names of complexes into subunits at the separator complex as annotate() does
+
+        The subunits of all reactants are compared to the ones of all products. A subunit
+        that is replaced by the product of a matching rule gets the reaction the urn and
+        SBO term of that rule; if no subunit changes, the reaction is a complex formation
+        or dissociation.
         """
-        pass # call eqWithIds here # TODO
-        # if reactant, product match r/p: set cv term
-        # check for complex formation
+        # canonical name -> list of (rule, canonical product name)
+        ruleIndex = {}
+
+        def getMatchingRules(name):
+            if name not in ruleIndex:
+                ruleIndex[name] = []
+                for rule in kb.rules:
+                    match = rule[0].search(name)
+                    if match and match.group(0) == name:
+                        ruleIndex[name].append((rule, kb.canonicalName(rule[0].sub(rule[1], name))))
+            return ruleIndex[name]
+
+        def getSubunits(speciesRefs):
+            subunits = []
+            for ref in speciesRefs:
+                species = self.model.getSpecies(ref.getSpecies())
+                if species != None:
+                    name = kb.canonicalName(species.getName())
+                    subunits.extend(name.split(complex) if complex else [name])
+            return subunits
+
+        for reaction in self.model.getListOfReactions():
+            reactants = getSubunits(reaction.getListOfReactants())
+            products = getSubunits(reaction.getListOfProducts())
+            added = list(products)
+            for subunit in reactants:
+                if subunit in added:
+                    added.remove(subunit)
+            removed = list(reactants)
+            for subunit in products:
+                if subunit in removed:
+                    removed.remove(subunit)
+
+            matches, sboTerm = [], None
+            for subunit in removed:
+                for rule, product in getMatchingRules(subunit):
+                    if product in added:
+                        qualifier, urn, sbo = rule[4:7]
+                        if urn.startswith("urn:") and [qualifier, urn] not in matches:
+                            matches.append([qualifier, urn])
+                        if sboTerm == None and sbo.startswith("SBO:"):
+                            sboTerm = int(sbo[4:])
+            if sboTerm == None and not removed and not added and reactants:
+                numReactants, numProducts = reaction.getNumReactants(), reaction.getNumProducts()
+                if numReactants > numProducts:
+                    sboTerm = 177 # non-covalent binding
+                elif numReactants < numProducts:
+                    sboTerm = 180 # dissociation
+
+            if matches:
+                self._setCVTerms(reaction, matches)
+            if sboTerm != None:
+                reaction.setSBOTerm(sboTerm)
 
     def _setCVTerms(self, sbobject, termList):
         """
@@ -115,77 +391,97 @@ class SBMLAnnotate:
                     cv.addResource(urn)
                 sbobject.addCVTerm(cv)#, newBag=True) # not supported by libsbml version at compneur
         else:
-            print "*** WARN: *** Could not annotate", sbobject.getName()
-
-    def _equalsWithIdentities(self, idList, name1, name2):
-        """
-        tests if 2 names are equal given the identity rules
-        """
-        for expr1, expr2 in idList:
-            for n1, n2 in [(name1, name2), (name2, name1)]:
-                if re.sub(expr1, expr2, n1) == n2:
-                    return True
-        return False
-
-    def _complementAnnotationList(self, modSpecAnn, modAnn):
-        """
-        takes the speciesAnnotation list and applies modification rules to it
-        returns the resulting list
-        """
-        for ma in modAnn:
-            for sa in modSpecAnn:
-                curSpec = deepcopy(sa)
-                curAnn = deepcopy(ma)
-                result = re.search(str(curAnn[0]), str(curSpec[0]))
-                if result and result.group(0) == curSpec[0]:
-                    curSpec[0] = re.sub(curAnn[0], curAnn[1], curSpec[0])
-                    if curAnn[2] == "modification":
-                        curSpec[1] = self._combineQualifiers(sa[1], "isVersionOf")
-                        modSpecAnn.append(curSpec)
-                    elif curAnn[2].startswith("addition"):
-                        curSpec[1] = "hasPart"
-                        modSpecAnn.append(sa)
-                        for part in curAnn[2].split(";")[1:]:
-                            curSpec[1:3] = ["hasPart", part]
-                            modSpecAnn.append(curSpec)
-                    elif curAnn[2].startswith("transport"):
-                        modSpecAnn.append(curSpec) # for now, don't annotate transports
-        return modSpecAnn
+            self.unannotated.append(sbobject.getName())
+            warn("Could not annotate", sbobject.getName(), echo=self.verbose)
 
-    def _loadSpeciesFile(self, fname):
-        """
-        parses the species annotation file into a list object
-        """
-        raw = loadtxt(fname, dtype=dtype("str"))
-        speciesIds = set([s[0] for s in raw])
-        speciesAnn = []
-        for id, qualifier, uri in raw:
-            if uri not in speciesIds:
-                speciesAnn.append([id, qualifier, uri])
-            else:
-                for refId, refQualifier, refUri in raw:
-                    if uri == refId:
-                        newQualifier = self._combineQualifiers(qualifier, refQualifier)
-                        if newQualifier != None:
-                            speciesAnn.append([id, newQualifier, refUri])
-        return speciesAnn
 
-    def _loadModificationFile(self, fname):
-        """
-        parses the mod/reaction annotation file into a list object
-        """
-        raw = loadtxt(fname, dtype=dtype("str"), delimiter="\t")
-        mods, ids = [], []
-        for line in raw:
-            if line[2] == "identity":
-                ids.append(line[0:2].tolist())
-            else:
-                mods.append(line.tolist())
-        return mods, ids
+# knowledge base of the batch run, set before the worker processes are forked so that they
+# share it copy-on-write instead of each loading or receiving their own copy
+batchKB = None
+
+
+def annotateFile(files):
+    """
+    Annotates one SBML file with the batch knowledge base, returns the input file name, the
+    list of unannotated species and an error message or None
+    """
+    infile, outfile = files
+    with Stage("annotate", infile) as trace:
+        try:
+            ann = SBMLAnnotate(infile, verbose=False)
+            ann.annotate(batchKB, complex="_")
+            ann.save(outfile)
+            return infile, ann.unannotated, None
+        except Exception, e:
+            trace.fields["error"] = str(e)
+            return infile, [], str(e)
+
+
+def annotateFiles(kb, files, outdir=None, processes=1):
+    """
+    Annotates a number of SBML files with the same knowledge base
+
+    Takes:
+    kb -- the KnowledgeBase instance
+    files -- list of SBML files and directories that contain them
+    outdir -- directory to save the annotated files in, or None to overwrite them
+    processes -- number of processes to annotate with
+
+    Returns:
+    list of (infile, unannotated species, error or None)
+    """
+    global batchKB
+    batchKB = kb
+    jobs = []
+    for fname in files:
+        for infile in sorted(glob.glob(os.path.join(fname, "*.xml"))) if os.path.isdir(fname) else [fname]:
+            jobs.append((infile, os.path.join(outdir, os.path.basename(infile)) if outdir else infile))
+
+    if processes > 1:
+        pool = Pool(processes)
+        results = pool.map(annotateFile, jobs)
+        pool.close()
+        pool.join()
+    else:
+        results = map(annotateFile, jobs)
+    return results
 
 
 if __name__ == "__main__":
-    ann = SBMLAnnotate(sys.argv[1])
-    ann.annotateSpecies(sys.argv[2], sys.argv[3], complex="_")
-    ann.save(sys.argv[4])
+    args = sys.argv[1:]
+    if args[:1] != ["-batch"]:
+        if len(args) != 4:
+            print __doc__
+            sys.exit(1)
+        with Stage("annotate", args[0]):
+            ann = SBMLAnnotate(args[0])
+            ann.annotateSpecies(args[1], args[2], complex="_")
+            ann.save(args[3])
+        sys.exit(0)
+
+    try:
+        args = args[1:]
+        options = {"-j" : "1", "-outdir" : None}
+        while args[0] in options:
+            options[args[0]] = args[1]
+            args = args[2:]
+        specFile, modFile, files = args[0], args[1], args[2:]
+        processes = int(options["-j"])
+        assert files
+    except Exception:
+        print __doc__
+        sys.exit(1)
+
+    outdir = options["-outdir"]
+    if outdir and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    with Stage("knowledge base", specFile):
+        kb = KnowledgeBase(specFile, modFile)
+    results = annotateFiles(kb, files, outdir, processes)
 
+    print "Annotated", len([r for r in results if r[2] == None]), "of", len(results), "models"
+    for infile, unannotated, error in results:
+        if error:
+            warn("Could not annotate", infile + ":", error)
+        elif unannotated:
+            print infile + ":", len(unannotated), "unannotated species:", ", ".join(unannotated)
@@ -16,8 +16,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-Usage: ./SBMLCleanup <infile> <outfile>
+Usage: ./SBMLCleanup [-stream] <infile> <outfile>
+       ./SBMLCleanup -compare <infile>
     Parameters are both mandatory but can be identical
+    -stream   : clean up while reading the file instead of loading the whole
+                document
+    -compare  : clean up in both ways and print where the results differ
     <infile>  : file name to be loaded and cleaned up
     <outfile> : file name to save the cleaned file
 
@@ -25,20 +29,50 @@ Examples:
     ./SBMLCleanup copasi.xml cleaned.xml
     Loads the file copasi.xml, performs standard cleanup operations, and 
     saves the resulting file under the name cleaned.xml.
+
+    ./SBMLCleanup -stream copasi.xml cleaned.xml
+    The same for very large files; see SBMLStreamCleanup for the differences.
+
+    ./SBMLCleanup -compare Bungay2003/Bungay2003.xml
+    Checks that both ways give the same model for an annotated file.
 """
 
-import sys, re
+import sys, re, os, tempfile, shutil, difflib, itertools
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
 from libsbml import *
+from telemetry import Stage, warn
+
+
+def filterName2Id(name):
+    """
+    Filters a given name of an entity to a valid ID string, ie. it removes
+    all special characters therein
+
+    Takes:
+    name -- the entity name
+
+    Returns:
+    name -- the filtered name that can be used as ID
+    """
+    replace = {"+":"_plus_", "*":"_star", ".":"_", "/":"_", " ":"_"}
+    for key, val in replace.items():
+        name = name.replace(key, val)
+    name = re.sub("[^\w]", "", name)
+    if name[0] in "0123456789":
+        name = "_" + name
+    return name
 
 
 class SBMLCleanup:
     """
     """
-    def __init__(self, filename):
+    def __init__(self, filename=None, doc=None):
         """
-        Initialises the class and loads the model from the file name given
+        Initialises the class and loads the model from the file name given, or uses
+        a libSBML document that is loaded already
         """
-        self.doc = SBMLReader().readSBMLFromFile(filename)
+        self.doc = doc if doc is not None else SBMLReader().readSBMLFromFile(filename)
         self.model = self.doc.getModel()
 
     def get(self):
@@ -57,7 +91,8 @@ class SBMLCleanup:
         """
         writeSBMLToFile(self.doc, filename)
 
-    def cleanup(self, general=True, doRound=True, removeAnnotations=False, resetMetaIds=True):
+    def cleanup(self, general=True, doRound=True, removeAnnotations=False, resetMetaIds=True, \
+            fixTime=True):
         """
         Main cleanup method
 
@@ -67,6 +102,7 @@ class SBMLCleanup:
         doRound -- flag to round all parameter values to 5 significant digits
         removeAnnotations -- flag to remove all annotations in the model
         resetMetaIds -- flag to reset all meta IDs by ascentding numbers after an underscore
+        fixTime -- flag to replace references to "time" in formulas by the time csymbol
         """
         if doRound:
             for species in self.model.getListOfSpecies():
@@ -74,33 +110,10 @@ class SBMLCleanup:
                 species.setInitialConcentration(float(conc))
 
         if general:
-            for species in self.model.getListOfSpecies():
-                newId = self.__filterName2Id(species.getName())
-                self.changeSpeciesId(species.getId(), newId)
-
-            for comp in self.model.getListOfCompartments():
-                newId = self.__filterName2Id(comp.getName())
-                self.__changeFormulas(comp.getId(), newId)
-                for species in self.model.getListOfSpecies():
-                    if species.getCompartment() == comp.getId():
-                        species.setCompartment(newId)
-                comp.setId(newId)
-
-            for param in self.model.getListOfParameters():
-                newId = self.__filterName2Id(param.getName())
-                self.changeParameterId(param.getId(), newId)
-
-            for reaction in self.model.getListOfReactions():
-                newId = self.__filterName2Id(reaction.getName())
-                self.changeReactionId(reaction.getId(), newId)
-
-            for function in self.model.getListOfFunctionDefinitions():
-                newId = self.__filterName2Id(function.getName())
-                self.__changeFormulas(function.getId(), newId)
-                function.setId(newId)
-
-            for evt in self.model.getListOfEvents():
-                evt.setId(self.__filterName2Id(evt.getName()))
+            idMap = {}
+            for elm in self.__getNamedElements():
+                idMap[elm.getId()] = filterName2Id(elm.getName()) if elm.getName() else elm.getId()
+            self.renameIds(idMap)
 
         if removeAnnotations:
             for elm in self.__getAllElements():
@@ -110,64 +123,48 @@ class SBMLCleanup:
             for i, elm in enumerate(self.__getAllElements()):
                 elm.setMetaId("_" + str(i))
 
-    def __filterName2Id(self, name):
-        """
-        Filters a given name of an entity to a valid ID string, ie. it removes
-        all special characters therein
-
-        Takes:
-        name -- the entity name
+        if fixTime:
+            self.fixTimeSymbol()
 
-        Returns:
-        name -- the filtered name that can be used as ID
+    def fixTimeSymbol(self):
+        """
+        Replaces names "time" in all formulas that do not refer to an entity of the model
+        by the SBML time csymbol, as written e.g. by tools that use infix formulas
         """
-        replace = {"+":"_plus_", "*":"_star", ".":"_", "/":"_", " ":"_"}
-        for key, val in replace.items():
-            name = name.replace(key, val)
-        name = re.sub("[^\w]", "", name)
-        if name[0] in "0123456789":
-            name = "_" + name
-        return name
+        if self.model.getElementBySId("time"):
+            return
+        for objectWithMathAST, localIds in self.__getMathElements():
+            if not objectWithMathAST or not objectWithMathAST.isSetMath() or "time" in localIds:
+                continue
+            stack = [objectWithMathAST.getMath()]
+            while stack:
+                node = stack.pop()
+                if node.getType() == AST_NAME and node.getName() == "time":
+                    node.setType(AST_NAME_TIME)
+                    node.setDefinitionURL("http://www.sbml.org/sbml/symbols/time")
+                stack.extend(node.getChild(i) for i in range(node.getNumChildren()))
 
     def changeCompartmentId(self, old, new):
         """
-        Changes the ID of a parameter from old to new and also replaces references
-        in the formulas.
+        Changes the ID of a compartment from old to new and also replaces references
+        in the species and formulas.
 
         Takes:
         old -- the ID used currently in the model
         new -- the ID by which the old one should be replaced
         """
-        curCompartment = self.model.getListOfCompartments().get(old)
-        if curCompartment.setId(new) != 0:
-            raise AssertionError("ERROR: could not replace " + old + " by " + new)
-        self.__changeFormulas(old, new)
+        self.renameIds({old : new})
 
     def changeSpeciesId(self, old, new):
         """
-        Changes the ID of a parameter from old to new and also replaces references
-        in the formulas.
+        Changes the ID of a species from old to new and also replaces references
+        in the reactions and formulas.
 
         Takes:
         old -- the ID used currently in the model
         new -- the ID by which the old one should be replaced
         """
-        #print "::", original, "-->", modified
-        # rename species, except on error
-        curSpecies = self.model.getListOfSpecies().get(old)
-        if curSpecies.setId(new) != 0:
-            raise AssertionError("ERROR: could not replace " + old + " by " + new)
-
-        # modify reaction entries
-        for reaction in self.model.getListOfReactions():
-            # rename species in all reactions
-            for reference in reaction.getReactant(old), \
-                    reaction.getProduct(old), \
-                    reaction.getModifier(old):
-                if reference:
-                    reference.setSpecies(new)
-
-        self.__changeFormulas(old, new)
+        self.renameIds({old : new})
 
     def changeParameterId(self, old, new):
         """
@@ -178,11 +175,7 @@ class SBMLCleanup:
         old -- the ID used currently in the model
         new -- the ID by which the old one should be replaced
         """
-        curParam = self.model.getListOfParameters().get(old)
-        if curParam.setId(new) != 0:
-            raise AssertionError("ERROR: could not replace " + old + " by " + new)
-
-        self.__changeFormulas(old, new)
+        self.renameIds({old : new})
 
     def changeReactionId(self, old, new):
         """
@@ -192,80 +185,457 @@ class SBMLCleanup:
         old -- the ID used currently in the model
         new -- the ID by which the old one should be replaced
         """
-        curReaction = self.model.getListOfReactions().get(old)
-        if curReaction.setId(new) != 0:
-            raise AssertionError("ERROR: could not replace " + old + " by " + new)
+        self.renameIds({old : new})
 
-    def __changeFormulas(self, old, new):
+    def renameIds(self, idMap):
         """
-        Changes the references of entities in formulas from old to new
+        Changes the IDs of all entities in idMap at once and replaces the references to
+        them in reactions, rules, assignments, and formulas. Only the places that actually
+        reference an entity are touched, as looked up in a reference index that is built
+        for each call, as the math nodes it holds do not outlive later changes of the
+        formulas. New IDs that would collide with each other or with existing ones get a
+        numbered suffix.
 
         Takes:
-        old -- the ID used currently in the model
-        new -- the ID by which the old one should be replaced
+        idMap -- a dictionary of the IDs used currently in the model -> the ones by which
+            they should be replaced
         """
-        for reaction in self.model.getListOfReactions():
-            self.__replace(reaction.getKineticLaw(), old, new)
+        idMap = self.__uniqueIds(idMap)
+        if not idMap:
+            return
+        index = self.__indexReferences()
+
+        # look up all references first, so that swapped IDs are not mixed up
+        moved = [(new, index.get(old, [])) for old, new in idMap.items()]
+        for new, references in moved:
+            for obj, setter in references:
+                if getattr(obj, setter)(new) != 0 and setter == "setId":
+                    raise AssertionError("ERROR: could not replace " + obj.getId() + " by " + new)
+
+    def __uniqueIds(self, idMap):
+        """
+        Removes unchanged entries from an ID map and makes sure the new IDs are unique
+        in the model, appending _2, _3, etc. to the ones that are not
 
-        for rule in self.model.getListOfRules():
-            self.__replace(rule, old, new)
-            if rule.getVariable() == old:
-                rule.setVariable(new)
+        Takes:
+        idMap -- a dictionary of old ID -> new ID
 
-        for asgn in self.model.getListOfInitialAssignments():
-            self.__replace(asgn, old, new)
-            if asgn.getSymbol() == old:
-                asgn.setSymbol(new)
+        Returns:
+        idMap -- the dictionary of old ID -> new unique ID
+        """
+        idMap = dict((old, new) for old, new in idMap.items() if old != new)
+        taken = set(elm.getId() for elm in self.__getNamedElements()) - set(idMap.keys())
+        unique = {}
+        for elm in self.__getNamedElements(): # in model order, so that suffixes are reproducible
+            old = elm.getId()
+            if old not in idMap:
+                continue
+            new, num = idMap[old], 2
+            while new in taken:
+                new = "%s_%d" % (idMap[old], num)
+                num += 1
+            if new != idMap[old]:
+                warn("ID", idMap[old], "already used, renaming", old, "to", new)
+            taken.add(new)
+            unique[old] = new
+        return unique
+
+    def __indexReferences(self):
+        """
+        Builds an index of all places in the model where entities are referenced by their
+        ID: the entities themselves, species compartments, outside compartments, species
+        references of reactions, rule variables, initial and event assignments, and names
+        in formulas except local parameters and function arguments.
 
+        Returns:
+        references -- a dictionary of ID -> list of (object, setter name)
+        """
+        references = {}
+        def add(id, obj, setter):
+            references.setdefault(id, []).append((obj, setter))
+
+        for elm in self.__getNamedElements():
+            add(elm.getId(), elm, "setId")
+        for species in self.model.getListOfSpecies():
+            add(species.getCompartment(), species, "setCompartment")
+        for comp in self.model.getListOfCompartments():
+            if comp.isSetOutside():
+                add(comp.getOutside(), comp, "setOutside")
+        for reaction in self.model.getListOfReactions():
+            for reference in list(reaction.getListOfReactants()) + \
+                    list(reaction.getListOfProducts()) + \
+                    list(reaction.getListOfModifiers()):
+                add(reference.getSpecies(), reference, "setSpecies")
+        for rule in self.model.getListOfRules():
+            if rule.isSetVariable():
+                add(rule.getVariable(), rule, "setVariable")
+        for asgn in self.model.getListOfInitialAssignments():
+            add(asgn.getSymbol(), asgn, "setSymbol")
         for evt in self.model.getListOfEvents():
-            self.__replace(evt.getTrigger(), old, new)
             for asgn in evt.getListOfEventAssignments():
-                if asgn.getVariable() == old:
-                    asgn.setVariable(new)
-                self.__replace(asgn, old, new)
+                add(asgn.getVariable(), asgn, "setVariable")
+
+        for objectWithMathAST, localIds in self.__getMathElements():
+            if not objectWithMathAST or not objectWithMathAST.isSetMath():
+                continue
+            stack = [objectWithMathAST.getMath()]
+            while stack:
+                node = stack.pop()
+                if node.getType() in (AST_NAME, AST_FUNCTION) and node.getName() not in localIds:
+                    add(node.getName(), node, "setName")
+                stack.extend(node.getChild(i) for i in range(node.getNumChildren()))
+
+        return references
+
+    def __getNamedElements(self):
+        """ Returns all entities whose IDs are renamed to their names by cleanup() """
+        return list(self.model.getListOfSpecies()) + \
+            list(self.model.getListOfCompartments()) + \
+            list(self.model.getListOfParameters()) + \
+            list(self.model.getListOfReactions()) + \
+            list(self.model.getListOfFunctionDefinitions()) + \
+            list(self.model.getListOfEvents())
+
+    def __getMathElements(self):
+        """
+        Returns all objects with a math AST, each with the set of names that are defined locally,
+        ie. local parameters of kinetic laws and arguments of functions
+        """
+        elements = []
+        for function in self.model.getListOfFunctionDefinitions():
+            args = set([function.getArgument(i).getName() for i in range(function.getNumArguments())])
+            elements.append((function, args))
+        for reaction in self.model.getListOfReactions():
+            law = reaction.getKineticLaw()
+            if law:
+                elements.append((law, set([p.getId() for p in law.getListOfParameters()])))
+        for elm in list(self.model.getListOfRules()) + \
+                list(self.model.getListOfInitialAssignments()) + \
+                list(self.model.getListOfConstraints()):
+            elements.append((elm, set()))
+        for evt in self.model.getListOfEvents():
+            elements += [(evt.getTrigger(), set()), (evt.getDelay(), set())]
+            elements += [(asgn, set()) for asgn in evt.getListOfEventAssignments()]
+        return elements
+
+    def __getAllElements(self):
+        return itertools.chain([self.model], \
+            self.model.getListOfSpecies(), \
+            self.model.getListOfReactions(), \
+            self.model.getListOfParameters(), \
+            self.model.getListOfCompartments(), \
+            self.model.getListOfFunctionDefinitions(), \
+            self.model.getListOfEvents(), \
+            self.model.getListOfRules(), \
+            self.model.getListOfInitialAssignments(), \
+            self.model.getListOfConstraints())
+
+
+class SBMLStreamCleanup:
+    """
+    Performs the cleanup operations of SBMLCleanup while reading the SBML file and writes
+    the result at the same time, so that the document tree is never held in memory. Of the
+    content, only single kinetic laws are held, because their local parameters are defined
+    after the formula; the map of renamed IDs and meta IDs still grows with the model.
+
+    As the file is read only once, IDs are renamed in document order. In SBML, entities
+    are defined before they are referenced, except for reactions in formulas of rules and
+    for outside compartments, which are therefore only renamed if they appear later in
+    the file. Meta IDs are numbered in document order.
+    """
+    timeSymbol = '<csymbol encoding="text" definitionURL="http://www.sbml.org/sbml/symbols/time">'
+
+    # entities that get a meta ID, and the ones renamed to their names (global parameters only)
+    metaIdElements = set(["model", "species", "reaction", "parameter", "compartment", \
+        "functionDefinition", "event", "assignmentRule", "rateRule", "algebraicRule", \
+        "initialAssignment", "constraint"])
+    namedElements = set(["species", "compartment", "parameter", "reaction", \
+        "functionDefinition", "event"])
+    # attributes that reference IDs of other entities
+    references = {"species" : ("compartment",), "compartment" : ("outside",), \
+        "speciesReference" : ("species",), "modifierSpeciesReference" : ("species",), \
+        "assignmentRule" : ("variable",), "rateRule" : ("variable",), \
+        "initialAssignment" : ("symbol",), "eventAssignment" : ("variable",)}
 
-        for cnst in self.model.getListOfConstraints():
-            self.__replace(cnst, old, new)
+    def __init__(self, filename):
+        """
+        Initialises the class with the file name of the model, which is not read yet
+        """
+        self.filename = filename
 
-    def __replace(self, objectWithMathAST, old, new):
+    def cleanup(self, outfile, general=True, doRound=True, removeAnnotations=False, \
+            resetMetaIds=True, fixTime=True, idMap=None):
         """
-        Replaces the occurence of all references to old with references to new entity 
-        IDs in the formula of a supplied object that holds a math AST.
+        Main cleanup method, reading the model and saving the result under outfile
 
         Takes:
-        objectWithMathAST -- an object with a math AST, eg. a function or kineticLaw
-        old -- the old reference ID
-        new -- the new reference ID
+        outfile -- file name to save the result; can be the input file name
+        general -- flag to change the names to IDs for species, compartments, parameters,
+            reactions, functions, events, and the formulas therein
+        doRound -- flag to round all initial concentrations to 7 significant digits
+        removeAnnotations -- flag to remove all annotations in the model
+        resetMetaIds -- flag to reset all meta IDs by ascending numbers after an underscore
+        fixTime -- flag to replace references to "time" in formulas by the time csymbol
+        idMap -- a dictionary of old ID -> new ID of additional IDs to change
+        """
+        self.general, self.doRound, self.fixTime = general, doRound, fixTime
+        self.removeAnnotations, self.resetMetaIds = removeAnnotations, resetMetaIds
+        self.idMap = dict(idMap or {})
+        self.taken = set(self.idMap.values())
+        self.metaIds = {} # old meta ID -> new one
+        self.numMetaIds = 0
+        self.stack = [] # names of currently open elements
+        self.text = [] # character data since the last tag
+        self.skip = 0 # depth inside a removed element
+        self.openTag = False # if the last start tag has not been closed by ">" yet
+        self.kineticLaw = None # output of the current kinetic law, with formula names unresolved
+        self.localIds = set() # local parameters or function arguments
+
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(outfile)))
+        self.out = os.fdopen(fd, "wb")
+        parser = expat.ParserCreate()
+        parser.returns_unicode = False
+        parser.ordered_attributes = True
+        parser.XmlDeclHandler = self._declaration
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._characters
+        parser.CommentHandler = self._comment
+        try:
+            parser.ParseFile(open(self.filename, "rb"))
+            self.out.write("\n")
+            self.out.close()
+            os.rename(tmpname, outfile)
+        except:
+            self.out.close()
+            os.remove(tmpname)
+            raise
+
+    def _declaration(self, version, encoding, standalone):
+        self.out.write('<?xml version="%s" encoding="UTF-8"?>\n' % version)
+
+    def _start(self, name, attrs):
+        tag = name.split(":")[-1]
+        if self.skip or (self.removeAnnotations and tag == "annotation" and "math" not in self.stack):
+            if not self.skip and not "".join(self.text).strip():
+                del self.text[:] # indentation of the removed element
+            self.skip += 1
+            return
+        self._flush()
+
+        attrs = [list(pair) for pair in zip(attrs[0::2], attrs[1::2])]
+        values = dict(attrs)
+        isLocal = tag == "parameter" and "kineticLaw" in self.stack
+        if tag == "kineticLaw":
+            self.kineticLaw = []
+            self.localIds = set()
+        elif tag == "functionDefinition":
+            self.localIds = set()
+        elif isLocal:
+            self.localIds.add(values.get("id"))
+
+        for attr in attrs:
+            key, value = attr
+            if key == "id" and self.general and tag in self.namedElements and not isLocal:
+                attr[1] = self._rename(value, values.get("name", value))
+            elif key == "id":
+                self.taken.add(value)
+            elif key in self.references.get(tag, ()):
+                attr[1] = self.idMap.get(value, value)
+            elif key == "initialConcentration" and self.doRound:
+                attr[1] = repr(float("%e" % float(value)))
+            elif key.endswith(":about") and value[1:] in self.metaIds:
+                attr[1] = "#" + self.metaIds[value[1:]]
+
+        if self.resetMetaIds and tag in self.metaIdElements and not isLocal:
+            newMetaId = "_" + str(self.numMetaIds)
+            self.numMetaIds += 1
+            if "metaid" in values:
+                self.metaIds[values["metaid"]] = newMetaId
+                attrs = [[key, newMetaId if key == "metaid" else value] for key, value in attrs]
+            else:
+                attrs.insert(0, ["metaid", newMetaId])
+
+        self.stack.append(tag)
+        startTag = "<" + name + "".join(" %s=%s" % (key, quoteattr(value)) for key, value in attrs)
+        if tag == "ci": # written at the end, as it could turn out to be the time csymbol
+            self.ciTag = startTag
+            return
+        self._write(startTag)
+        self.openTag = True
+
+    def _end(self, name):
+        if self.skip:
+            self.skip -= 1
+            return
+        tag = self.stack.pop()
+
+        if tag == "ci":
+            text = "".join(self.text)
+            del self.text[:]
+            ident = text.strip()
+            if self.stack[-1] == "bvar":
+                self.localIds.add(ident)
+                self._write(self.ciTag + ">" + escape(text) + "</" + name + ">")
+            else:
+                pre, post = text[:text.index(ident)], text[text.index(ident) + len(ident):]
+                self._write((self.ciTag, escape(pre), ident, escape(post), name))
+            return
+
+        self._flush(close=False)
+        if self.openTag:
+            self._write("/>")
+            self.openTag = False
+        else:
+            self._write("</" + name + ">")
+
+        if tag == "kineticLaw":
+            output, self.kineticLaw = self.kineticLaw, None
+            for piece in output:
+                self._write(piece)
+        if tag in ("kineticLaw", "functionDefinition"):
+            self.localIds = set()
+
+    def _characters(self, data):
+        if not self.skip: # the text of removed elements is dropped with them
+            self.text.append(data)
+
+    def _comment(self, data):
+        if not self.skip:
+            self._flush()
+            self._write("<!--" + data + "-->")
+
+    def _flush(self, close=True):
+        """ Writes character data collected so far and closes an open start tag if needed """
+        text = "".join(self.text)
+        del self.text[:]
+        if self.openTag and (text or close):
+            self._write(">")
+            self.openTag = False
+        if text:
+            self._write(escape(text))
+
+    def _write(self, piece):
+        """
+        Writes a piece of output, or holds it back while inside a kinetic law. A tuple is a
+        ci element with a name in a formula as (start tag, text before, name, text after,
+        tag name) that is renamed unless it is a local parameter or function argument.
         """
-        fml = re.sub("(?<!\w)" + old + "(?!\w)", new, formulaToString(objectWithMathAST.getMath()))
-        objectWithMathAST.setMath(parseFormula(fml))
+        if self.kineticLaw is not None:
+            self.kineticLaw.append(piece)
+        elif isinstance(piece, tuple):
+            startTag, pre, ident, post, name = piece
+            if ident in self.localIds:
+                pass
+            elif ident == "time" and self.fixTime and "time" not in self.taken:
+                startTag, name = self.timeSymbol[:-1], "csymbol"
+            else:
+                ident = self.idMap.get(ident, ident)
+            self.out.write(startTag + ">" + pre + escape(ident) + post + "</" + name + ">")
+        else:
+            self.out.write(piece)
+
+    def _rename(self, old, name):
+        """ Returns a unique ID derived from the entity name and adds it to the ID map """
+        base = filterName2Id(name) if name else old
+        new, num = base, 2
+        while new in self.taken:
+            new = "%s_%d" % (base, num)
+            num += 1
+        if new != base:
+            warn("ID", base, "already used, renaming", old, "to", new)
+        self.taken.add(new)
+        self.idMap[old] = new
+        return new
+
+
+def canonicalContent(filename):
+    """
+    Returns the elements, attributes and text of an XML file as a list of lines, without
+    meta IDs, comments and whitespace between elements, and with numbers in one notation
 
-    def __getAllElements(self):
-        return [self.model] + \
-            list(self.model.getListOfSpecies()) + \
-            list(self.model.getListOfReactions()) + \
-            list(self.model.getListOfParameters()) + \
-            list(self.model.getListOfCompartments()) + \
-            list(self.model.getListOfFunctionDefinitions()) + \
-            list(self.model.getListOfEvents()) + \
-            list(self.model.getListOfRules()) + \
-            list(self.model.getListOfInitialAssignments()) + \
-            list(self.model.getListOfConstraints())
+    Takes:
+    filename -- the file to read
+    """
+    def number(value):
+        try:
+            return repr(float(value))
+        except ValueError:
+            return value
+
+    lines, text = [], []
+    def flush():
+        data = "".join(text).strip()
+        del text[:]
+        if data:
+            lines.append(number(data))
+    def start(name, attrs):
+        flush()
+        lines.append("<%s%s>" % (name, "".join([' %s="%s"' % (key, number(value)) \
+            for key, value in sorted(attrs.items()) if key != "metaid"])))
+    def end(name):
+        flush()
+        lines.append("</%s>" % name)
+
+    parser = expat.ParserCreate()
+    parser.returns_unicode = False
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = text.append
+    parser.ParseFile(open(filename, "rb"))
+    return lines
+
+
+def compareCleanups(filename, **options):
+    """
+    Cleans up a model with both SBMLCleanup and SBMLStreamCleanup and compares the results;
+    meta IDs are left out, as they are numbered in a different order
+
+    Takes:
+    filename -- the model file
+    options -- the flags of the cleanup methods
+
+    Returns:
+    diff -- list of the lines of a unified diff of the two results, empty if they agree
+    """
+    dir = tempfile.mkdtemp()
+    try:
+        domFile, streamFile = os.path.join(dir, "dom.xml"), os.path.join(dir, "stream.xml")
+        tool = SBMLCleanup(filename)
+        tool.cleanup(**options)
+        tool.save(domFile)
+        SBMLStreamCleanup(filename).cleanup(streamFile, **options)
+        return list(difflib.unified_diff(canonicalContent(domFile), canonicalContent(streamFile), \
+            "SBMLCleanup", "SBMLStreamCleanup", lineterm=""))
+    finally:
+        shutil.rmtree(dir)
 
 
 if __name__ == "__main__":
     """
     Makes the script routines accessible to the command-line.
     """
-    try:
-        infile = sys.argv[1]
-        outfile = sys.argv[2]
+    if sys.argv[1:2] == ["-compare"] and len(sys.argv) == 3:
+        diff = compareCleanups(sys.argv[2], removeAnnotations=True)
+        for line in diff:
+            print line
+        print "The cleanups %s" % ("differ" if diff else "agree")
+        sys.exit(1 if diff else 0)
 
-        tool = SBMLCleanup(infile)
-        tool.cleanup(removeAnnotations=True)
-        tool.save(outfile)
+    try:
+        stream = sys.argv[1] == "-stream"
+        infile = sys.argv[1 + stream]
+        outfile = sys.argv[2 + stream]
+
+        with Stage("cleanup", infile, stream=stream):
+            if stream:
+                SBMLStreamCleanup(infile).cleanup(outfile, removeAnnotations=True)
+            else:
+                tool = SBMLCleanup(infile)
+                tool.cleanup(removeAnnotations=True)
+                tool.save(outfile)
     except:
-        print("Usage: ./SBMLTools <infile> <outfile>")
+        print(__doc__)
 #    finally:
 #        raise
 
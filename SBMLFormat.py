@@ -0,0 +1,164 @@
+#!/usr/bin/env python2.7
+#
+# SBMLFormat writes SBML files with consistent indentation and line wrapping
+# - written by Michael Schubert, EMBL-EBI, 2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Usage: ./SBMLFormat.py [-indent <n>] [-wrap <n>] <infile> <outfile>
+    <infile>  : SBML file to format
+    <outfile> : file name to save the formatted file; can be the same
+    -indent   : number of spaces per level of nesting, default 2
+    -wrap     : maximum line width, default 95
+
+Examples:
+    ./SBMLFormat.py model.xml model.xml
+    Formats model.xml in place, like "tidy -m -i -xml -wrap 95 model.xml".
+"""
+
+import sys
+import textwrap
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
+from libsbml import writeSBMLToString
+
+
+class SBMLFormatter:
+    """
+    Indents an XML string by its nesting level and wraps start tags with many attributes
+    and the text of notes at a given line width. Character data other than whitespace
+    between tags is kept as it is, except inside notes, where it is XHTML.
+    """
+    def __init__(self, indent=2, wrap=95):
+        self.indent = indent
+        self.wrap = wrap
+
+    def format(self, xml):
+        """
+        Returns the formatted version of an XML string
+        """
+        self.lines = []
+        self.depth = 0
+        self.text = []
+        self.openTag = None # start tag of the current element, until its content is known
+        self.hasChildren = [False]
+        self.inNotes = 0
+
+        parser = expat.ParserCreate()
+        parser.returns_unicode = False
+        parser.ordered_attributes = True
+        parser.XmlDeclHandler = self._declaration
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self.text.append
+        parser.CommentHandler = self._comment
+        parser.Parse(xml, True)
+        return "\n".join(self.lines) + "\n"
+
+    def _declaration(self, version, encoding, standalone):
+        self.lines.append('<?xml version="%s" encoding="%s"?>' % (version, encoding or "UTF-8"))
+
+    def _start(self, name, attrs):
+        self._flush()
+        self.hasChildren[-1] = True
+        self.hasChildren.append(False)
+        attrs = ["%s=%s" % (key, quoteattr(value)) for key, value in zip(attrs[0::2], attrs[1::2])]
+        self.openTag = self._startTag(name, attrs)
+        self.depth += 1
+        if name.split(":")[-1] == "notes":
+            self.inNotes += 1
+
+    def _end(self, name):
+        text = "".join(self.text)
+        del self.text[:]
+        hasChildren = self.hasChildren.pop()
+        if self.openTag is not None:
+            inline = self.openTag + escape(" ".join(text.split()) if self.inNotes else text) + \
+                "</%s>" % name
+        if self.openTag is not None and not text:
+            self.lines.append(self.openTag[:-1] + "/>")
+            self.depth -= 1
+        elif self.openTag is not None and (not self.inNotes or len(inline) <= self.wrap):
+            self.lines.append(inline)
+            self.depth -= 1
+        else:
+            self._flush(text)
+            self.depth -= 1
+            self.lines.append(self._prefix() + "</%s>" % name)
+        self.openTag = None
+        if name.split(":")[-1] == "notes":
+            self.inNotes -= 1
+
+    def _comment(self, data):
+        self._flush()
+        self.lines.append(self._prefix() + "<!--%s-->" % data)
+
+    def _flush(self, text=None):
+        """ Writes the pending start tag and character data on lines of their own """
+        if text is None:
+            text = "".join(self.text)
+            del self.text[:]
+        if self.openTag is not None:
+            self.lines.append(self.openTag)
+            self.openTag = None
+        if text.strip():
+            if self.inNotes:
+                self.lines.extend(textwrap.wrap(escape(" ".join(text.split())), self.wrap, \
+                    initial_indent=self._prefix(), subsequent_indent=self._prefix()))
+            else:
+                self.lines.append(self._prefix() + escape(text.strip()))
+
+    def _prefix(self):
+        return " " * (self.indent * self.depth)
+
+    def _startTag(self, name, attrs):
+        """ Returns the start tag, with one attribute per line if it is too long """
+        tag = self._prefix() + "<" + " ".join([name] + attrs) + ">"
+        if len(tag) <= self.wrap or len(attrs) < 2:
+            return tag
+        continuation = "\n" + " " * (len(self._prefix()) + len(name) + 2)
+        return self._prefix() + "<" + name + " " + continuation.join(attrs) + ">"
+
+
+def writeSBML(doc, filename, indent=2, wrap=95):
+    """
+    Writes a libsbml document to a file, formatted with the given indentation and wrap width
+
+    Takes:
+    doc -- the libsbml SBMLDocument
+    filename -- the file name to write to
+    indent -- number of spaces per level of nesting
+    wrap -- maximum line width
+    """
+    xml = SBMLFormatter(indent, wrap).format(writeSBMLToString(doc))
+    open(filename, "wb").write(xml)
+
+
+if __name__ == "__main__":
+    """
+    Makes formatting of existing files accessible to the command-line.
+    """
+    try:
+        args = sys.argv[1:]
+        options = {"-indent" : 2, "-wrap" : 95}
+        while args[0] in options:
+            options[args[0]] = int(args[1])
+            args = args[2:]
+        infile, outfile = args
+    except Exception:
+        print __doc__
+        sys.exit(1)
+
+    xml = SBMLFormatter(options["-indent"], options["-wrap"]).format(open(infile, "rb").read())
+    open(outfile, "wb").write(xml)
@@ -5,6 +5,7 @@ dir = os.getcwd()
 import numpy as np
 import matplotlib.pyplot as plt
 import pysces
+from thrombinMetrics import firstCrossing
 
 models = [("PT test", "Wajima2009_PTtest.xml", 0, 7), \
     ("aPTT test", "Wajima2009_aPTTtest.xml", 2, 6)]
@@ -46,7 +47,7 @@ for model in models:
     plt.ylabel("Integral of Fibrin (nmol/l.s)")
     
     coag_y = 1.5e3
-    coag_x = time[list(data("Integral_Fibrin")*3600 > coag_y).index(1)]
+    coag_x = firstCrossing(time, data("Integral_Fibrin")*3600, coag_y)[0]
     plt.plot([0, coag_x, coag_x], [coag_y, coag_y, 0.1], "k--")
 
 plt.savefig(figure)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python2.7
+#
+# CurationPipeline runs all curation steps on one SBML document in memory.
+# - written by Michael Schubert, EMBL-EBI, 2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Usage: ./curationPipeline.py -param value ... <infile> <outfile>
+    <infile>   : SBML file to curate
+    <outfile>  : file name to save the curated and formatted file; can be the same
+    -stages    : comma-separated stages to run in this order, default
+                 sbo,annotate,validate; available are cleanup, sbo, annotate,
+                 and validate
+    -sbo <f>   : rate law library for the sbo stage, e.g. MAMM.map
+    -species <f>   : species annotation file for the annotate stage
+    -reactions <f> : modification/reaction annotation file for the annotate stage
+    -checkpoint <stage>:<file> : save the document after a stage to a file as
+                 well; can be repeated
+    -cache <dir> : directory to keep the result of every stage in, keyed by
+                 the hash of its input document and everything else it depends
+                 on; stages whose result is in there are not run again
+
+Examples:
+    ./curationPipeline.py -stages cleanup copasi.xml model.xml
+    Cleans up an SBML file exported by Copasi, like SBMLCleanup.py.
+
+    ./curationPipeline.py -sbo MAMM.map -species annotateSpecies.txt \\
+        -reactions annotateModifications.txt model.xml model.xml.ready
+    Adds SBO terms to the rate laws, annotates species and reactions, and
+    validates model.xml. The file is read and written only once, and the
+    exit code is 1 if the model is invalid.
+"""
+
+import sys
+import os
+import hashlib
+import tempfile
+import cPickle as pickle
+from libsbml import SBMLReader, writeSBMLToString, getLibSBMLDottedVersion
+from SBMLCleanup import SBMLCleanup
+from SBMLAnnotate import SBMLAnnotate, KnowledgeBase
+from SBMLFormat import SBMLFormatter, writeSBML
+from validateSBML import validateSBML, countErrors, isSerious
+from telemetry import Stage
+
+
+class CurationPipeline:
+    """
+    Holds one libSBML document and runs the curation stages on it, so that the file
+    is parsed and serialized only once instead of once for every script.
+
+    If a cache directory is given, the result of each stage is stored there under the
+    hash of its input document, the libSBML version, the source of the code that runs
+    it and the files it uses. A stage with a stored result is not run, and the document
+    is not even parsed as long as all stages are found in the cache.
+
+    Takes:
+    filename -- the SBML file to curate
+    sboFile -- the rate law library for the sbo stage
+    specFile -- the species annotation file for the annotate stage
+    modFile -- the modification/reaction annotation file for the annotate stage
+    cacheDir -- directory of the stage cache, or None to not use it
+    """
+    stages = ("cleanup", "sbo", "annotate", "validate")
+    cacheVersion = 1
+    # source files of the code run by each stage, next to this one
+    stageSources = {"cleanup" : ["SBMLCleanup.py"], "sbo" : ["expressionMapper.py", "lawLibrary.py"], \
+        "annotate" : ["SBMLAnnotate.py"], "validate" : ["validateSBML.py"]}
+
+    def __init__(self, filename, sboFile=None, specFile=None, modFile=None, cacheDir=None):
+        self.filename = filename
+        # the document is parsed from the XML string only when a stage needs it,
+        # and the XML string is updated only when the cache needs it
+        self.xml = open(filename, "rb").read()
+        self.doc = None
+        self.sboFile = sboFile
+        self.specFile = specFile
+        self.modFile = modFile
+        self.cacheDir = cacheDir
+        # file name -> hash of its contents
+        self.fileHashes = {}
+        # stage -> list of file names to save the document to after that stage
+        self.checkpoints = {}
+        self.valid = True
+
+    def addCheckpoint(self, stage, filename):
+        """ Saves the document to a file after the given stage was run """
+        self.checkpoints.setdefault(stage, []).append(filename)
+
+    def run(self, stages):
+        """ Runs the given stages in order and saves the checkpoints """
+        for stage in stages:
+            with Stage(stage, self.filename) as trace:
+                if self.cacheDir is None:
+                    getattr(self, stage)()
+                else:
+                    trace.fields["cached"] = self.runCached(stage)
+            for filename in self.checkpoints.get(stage, []):
+                self.save(filename)
+
+    def runCached(self, stage):
+        """
+        Restores the result of a stage from the cache, or runs it and stores the result;
+        returns whether it was in the cache
+        """
+        key = self.stageKey(stage)
+        fname = os.path.join(self.cacheDir, key)
+        try:
+            xml, result = pickle.load(open(fname, "rb"))
+        except Exception:
+            result = getattr(self, stage)()
+            xml = self.getXML() if stage != "validate" else None
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            fd, tmp = tempfile.mkstemp(dir=self.cacheDir)
+            os.fdopen(fd, "wb").write(pickle.dumps((xml, result), pickle.HIGHEST_PROTOCOL))
+            os.rename(tmp, fname) # concurrent runs store the same result
+            return False
+        if xml is not None:
+            self.xml, self.doc = xml, None
+        if stage == "validate":
+            self.report(result)
+        return True
+
+    def stageKey(self, stage):
+        """ Returns the hash of everything the result of a stage depends on """
+        basedir = os.path.dirname(os.path.abspath(__file__))
+        files = [os.path.join(basedir, f) for f in ["curationPipeline.py"] + self.stageSources[stage]]
+        if stage == "sbo":
+            files.append(self.sboFile)
+        elif stage == "annotate":
+            files += [self.specFile, self.modFile]
+
+        key = hashlib.sha1("%d %s %s\n" % (self.cacheVersion, stage, getLibSBMLDottedVersion()))
+        for fname in files:
+            if fname not in self.fileHashes:
+                self.fileHashes[fname] = hashlib.sha1(open(fname, "rb").read()).hexdigest()
+            key.update(self.fileHashes[fname])
+        key.update(self.getXML())
+        return key.hexdigest()
+
+    def getDoc(self):
+        """ Returns the document, parsing it if needed; the caller may modify it """
+        if self.doc is None:
+            self.doc = SBMLReader().readSBMLFromString(self.xml)
+        self.xml = None
+        return self.doc
+
+    def getXML(self):
+        """ Returns the current document as XML string """
+        if self.xml is None:
+            self.xml = writeSBMLToString(self.doc)
+        return self.xml
+
+    def save(self, filename):
+        """ Saves the formatted document """
+        if self.doc is None:
+            open(filename, "wb").write(SBMLFormatter().format(self.xml))
+        else:
+            writeSBML(self.doc, filename)
+
+    def cleanup(self):
+        """ Converts names to Ids, resets meta Ids and fixes the time symbol """
+        SBMLCleanup(doc=self.getDoc()).cleanup(removeAnnotations=True)
+
+    def sbo(self):
+        """ Annotates the rate laws with SBO terms """
+        # imported here as SymPy takes most of the start-up time, which is not needed
+        # if the result of this stage is in the cache
+        from expressionMapper import ExpressionMatcher, annotateSBML
+        em = ExpressionMatcher()
+        em.load(self.sboFile)
+        annotateSBML(self.getDoc().getModel(), em)
+
+    def annotate(self):
+        """ Annotates species and reactions with the knowledge base """
+        SBMLAnnotate(doc=self.getDoc()).annotate(KnowledgeBase(self.specFile, self.modFile), complex="_")
+
+    def validate(self):
+        """ Checks the consistency of the document, prints and returns the result """
+        # a document parsed here, as the first stage or after one restored from the cache,
+        # keeps its read errors; one that earlier stages changed in memory still holds those
+        # of the input file, which no longer apply
+        parsed = self.doc is None
+        xml = self.xml
+        doc = self.getDoc()
+        self.xml = xml # validation does not change the document
+        if not parsed:
+            doc.getErrorLog().clearLog()
+        result = validateSBML(True).checkDocument(doc)
+        self.report(result)
+        return result
+
+    def report(self, result):
+        """ Prints the errors found by the validate stage """
+        numErr, numWarn = [sum(counts) for counts in zip(countErrors(result, "read"), \
+            countErrors(result, "consistency"))]
+        print "Validated %s: %d error(s), %d warning(s)" % (self.filename, numErr, numWarn)
+        for error in result["errors"]:
+            if isSerious(error):
+                print "  %(severity)s %(id)d (%(category)s) line %(line)d: %(message)s" % error
+        self.valid = result["valid"]
+
+
+if __name__ == "__main__":
+    """
+    Makes the pipeline accessible to the command-line.
+    """
+    try:
+        args = sys.argv[1:]
+        options = {"-stages" : "sbo,annotate,validate", "-sbo" : None, "-species" : None, \
+            "-reactions" : None, "-cache" : None}
+        checkpoints = []
+        while len(args) > 2:
+            if args[0] == "-checkpoint":
+                checkpoints.append(args[1].split(":", 1))
+            else:
+                if args[0] not in options:
+                    raise KeyError(args[0])
+                options[args[0]] = args[1]
+            args = args[2:]
+        infile, outfile = args
+        stages = options["-stages"].split(",")
+        for stage in stages + [c[0] for c in checkpoints]:
+            assert stage in CurationPipeline.stages
+        assert "sbo" not in stages or options["-sbo"]
+        assert "annotate" not in stages or (options["-species"] and options["-reactions"])
+    except Exception:
+        print __doc__
+        sys.exit(1)
+
+    pipeline = CurationPipeline(infile, options["-sbo"], options["-species"], options["-reactions"], \
+        options["-cache"])
+    for stage, filename in checkpoints:
+        pipeline.addCheckpoint(stage, filename)
+    pipeline.run(stages)
+    pipeline.save(outfile)
+    if not pipeline.valid:
+        sys.exit(1)
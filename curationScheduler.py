@@ -0,0 +1,352 @@
+#!/usr/bin/env python2.7
+#
+# CurationScheduler curates and plots all models in parallel.
+# - written by Michael Schubert, EMBL-EBI, 2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Usage: ./curationScheduler.py -param value ... <dir> [<dir> ...]
+    <dir>     : directory of a model, or a directory whose subdirectories are
+                the model directories
+    -j <n>    : number of tasks to run at once, default 1
+    -state <f>: JSON file to remember the finished tasks in, so that an
+                interrupted or failed run can be resumed; default none
+    -python <f> : python executable to run the tasks with, default this one
+    -copasi <f> : Copasi command-line executable, default CopasiSE
+    -cache <dir>: stage cache directory passed on to curationPipeline.py
+    -watch    : after the run, wait for models, knowledge files or scripts to
+                change and run again what depends on them, until interrupted
+    -poll     : with -watch, compare modification times instead of using inotify
+
+Examples:
+    ./curationScheduler.py -j 8 -state .schedule.json .
+    Finds all model directories below the current one and exports their
+    Copasi files, curates the SBML files and renders the figures, with up
+    to 8 tasks at once. If a task fails, only the tasks that depend on it
+    are skipped. Run again to redo only what failed or changed.
+
+    ./curationScheduler.py -watch -cache .cache .
+    Curates and plots all models, then keeps doing so for the models whose
+    files change. An edited figure spec is only rendered again, and an edited
+    annotation file only re-runs the annotation and validation stages, as the
+    other stages are restored from the cache.
+"""
+
+import sys
+import os
+import glob
+import json
+import time
+import hashlib
+import tempfile
+import subprocess
+import Queue
+from multiprocessing.pool import ThreadPool
+from telemetry import record
+from fileWatcher import createWatcher
+from curationPipeline import CurationPipeline
+
+
+class Scheduler:
+    """
+    Runs tasks that depend on each other with a bounded number of worker threads, each
+    of which waits for its task's commands as subprocesses.
+
+    A task is skipped if one it depends on failed or was skipped. Successful tasks are
+    remembered in a state file with a signature of their commands and input files, and
+    are not run again as long as that signature and their outputs are unchanged.
+
+    Takes:
+    stateFile -- the JSON file to keep the signatures of finished tasks in, or None
+    processes -- the number of tasks to run at once
+    """
+    def __init__(self, stateFile=None, processes=1):
+        self.stateFile = stateFile
+        self.processes = processes
+        # task name -> (working directory, commands, input files, output files, dependencies)
+        self.tasks = {}
+        self.order = []
+        self.state = {}
+        if stateFile and os.path.exists(stateFile):
+            self.state = json.load(open(stateFile))
+
+    def add(self, name, cwd, commands, inputs, outputs, deps=()):
+        """
+        Adds a task
+
+        Takes:
+        name -- the unique name of the task
+        cwd -- the directory to run the commands in
+        commands -- list of argument lists, run one after the other
+        inputs -- files the result depends on, relative to cwd
+        outputs -- files the task creates, relative to cwd
+        deps -- names of the tasks that need to finish before this one
+        """
+        self.tasks[name] = (cwd, commands, inputs, outputs, list(deps))
+        self.order.append(name)
+
+    def clear(self):
+        """ Removes all tasks, but keeps the signatures of the finished ones """
+        self.tasks = {}
+        self.order = []
+
+    def files(self, outputs=False):
+        """ Returns the absolute names of the input files, or output files, of all tasks """
+        files = set()
+        for task in self.tasks.values():
+            cwd = task[0]
+            files.update([os.path.abspath(os.path.join(cwd, f)) for f in task[3 if outputs else 2]])
+        return files
+
+    def signature(self, name):
+        """ Returns the hash of the commands and the contents of the input files of a task """
+        cwd, commands, inputs, outputs, deps = self.tasks[name]
+        sha = hashlib.sha1(repr(commands))
+        for fname in inputs:
+            fname = os.path.join(cwd, fname)
+            sha.update(open(fname, "rb").read() if os.path.exists(fname) else "")
+        return sha.hexdigest()
+
+    def run(self):
+        """
+        Runs all tasks, returns a dict of task name -> status, which is one of "done",
+        "uptodate", "failed", or "skipped"
+        """
+        status = {}
+        pending = list(self.order)
+        finished = Queue.Queue()
+        pool = ThreadPool(self.processes)
+        running = 0
+        # task name -> signature of the inputs the running task started from; an input
+        # that changes while the task runs makes it run again the next time
+        started = {}
+        while pending or running:
+            changed = True
+            while changed:
+                changed = False
+                for name in list(pending):
+                    cwd, commands, inputs, outputs, deps = self.tasks[name]
+                    depStatus = [status.get(dep) for dep in deps if dep in self.tasks]
+                    if "failed" in depStatus or "skipped" in depStatus:
+                        status[name] = "skipped"
+                    elif [s for s in depStatus if s not in ("done", "uptodate")]:
+                        continue
+                    elif self.state.get(name) == self.signature(name) and \
+                            all([os.path.exists(os.path.join(cwd, f)) for f in outputs]):
+                        status[name] = "uptodate"
+                    else:
+                        started[name] = self.signature(name)
+                        pool.apply_async(runTask, (name, cwd, commands), callback=finished.put)
+                        status[name] = "running"
+                        running += 1
+                    pending.remove(name)
+                    changed = True
+
+            if not running:
+                break
+            name, returncode, output, seconds = finished.get()
+            running -= 1
+            print "=== %s (%s, %.1fs)" % (name, "ok" if returncode == 0 else "failed", seconds)
+            record("task", task=name, wall=seconds, returncode=returncode)
+            if output:
+                print output.rstrip()
+            if returncode == 0:
+                status[name] = "done"
+                self.state[name] = started[name]
+            else:
+                status[name] = "failed"
+                self.state.pop(name, None)
+            self.save()
+
+        pool.close()
+        pool.join()
+        for name in pending: # dependencies that do not exist
+            status[name] = "skipped"
+        return status
+
+    def save(self):
+        """ Writes the state file, if any """
+        if not self.stateFile:
+            return
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.stateFile)))
+        os.fdopen(fd, "w").write(json.dumps(self.state, indent=1, sort_keys=True))
+        os.rename(tmp, self.stateFile)
+
+
+def runTask(name, cwd, commands):
+    """
+    Runs the commands of a task until one fails, returns the task name, the return code,
+    the combined output, and the time taken
+    """
+    start = time.time()
+    output = []
+    returncode = 0
+    for command in commands:
+        try:
+            process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, \
+                stderr=subprocess.STDOUT)
+            output.append(process.communicate()[0])
+            returncode = process.returncode
+        except OSError, e:
+            output.append("%s: %s" % (command[0], e))
+            returncode = 127
+        except Exception, e: # the scheduler waits for every task, so none may raise
+            output.append("%s: %s: %s" % (command[0] if command else name, e.__class__.__name__, e))
+            returncode = 1
+        if returncode != 0:
+            break
+    return name, returncode, "".join(output), time.time() - start
+
+
+def findModels(dirs):
+    """ Returns the given directories and their subdirectories that contain model files """
+    models = []
+    for root in dirs:
+        candidates = [root] + [os.path.join(root, d) for d in sorted(os.listdir(root)) \
+            if not d.startswith(".")]
+        for dir in candidates:
+            if os.path.isdir(dir) and (glob.glob(os.path.join(dir, "*.cps")) or \
+                    glob.glob(os.path.join(dir, "*.xml"))):
+                models.append(os.path.normpath(dir))
+    return models
+
+
+def addModel(scheduler, dir, python, copasi, cache=None):
+    """
+    Adds the tasks of one model directory, as in the Makefile: export of Copasi files
+    to SBML and their cleanup, curation of all SBML files, then the figures and all
+    plot scripts.
+    The inputs of each task include the scripts it runs, so that a task is run again
+    if one of them changes.
+    """
+    basedir = os.path.dirname(os.path.abspath(__file__))
+    pipeline = [python, os.path.join(basedir, "curationPipeline.py")]
+    if cache:
+        pipeline += ["-cache", os.path.abspath(cache)]
+    knowledge = [os.path.join(basedir, f) for f in \
+        ("MAMM.map", "annotateSpecies.txt", "annotateModifications.txt")]
+    sources = lambda stages: [os.path.join(basedir, f) for f in ["curationPipeline.py", "SBMLFormat.py"] + \
+        sum([CurationPipeline.stageSources[stage] for stage in stages], [])]
+
+    ready = []
+    exported = [os.path.basename(f)[:-4] + ".xml" for f in sorted(glob.glob(os.path.join(dir, "*.cps")))]
+    for xml in exported:
+        cps = xml[:-4] + ".cps"
+        scheduler.add(os.path.join(dir, xml), dir, [
+            [copasi, "--SBMLSchema", "L2V4", "-e", xml, cps],
+            pipeline + ["-stages", "cleanup", xml, xml]], [cps] + sources(["cleanup"]), [xml])
+
+    sbml = [os.path.basename(f) for f in sorted(glob.glob(os.path.join(dir, "*.xml")))]
+    for xml in sorted(set(sbml + exported)):
+        deps = [os.path.join(dir, xml)] if xml in exported else []
+        scheduler.add(os.path.join(dir, xml + ".ready"), dir, [pipeline + ["-sbo", knowledge[0], \
+            "-species", knowledge[1], "-reactions", knowledge[2], xml, xml + ".ready"]], \
+            [xml] + knowledge + sources(["sbo", "annotate", "validate"]), [xml + ".ready"], deps)
+        ready.append(xml + ".ready")
+
+    spec = os.path.join(dir, "figures.json")
+    if os.path.exists(spec):
+        runner = [python, os.path.join(basedir, "figureRunner.py")]
+        if cache:
+            runner += ["-cache", os.path.abspath(cache)]
+        outputs = [figure["output"] for figure in json.load(open(spec))["figures"]]
+        scheduler.add(spec, dir, [runner + ["figures.json"]], ["figures.json"] + sorted(set(sbml + exported)) + \
+            ready + [os.path.join(basedir, f) for f in ("figureRunner.py", "Copasi.py")], outputs, \
+            [os.path.join(dir, r) for r in ready])
+
+    for plot in sorted(glob.glob(os.path.join(dir, "plot*.py"))):
+        plot = os.path.basename(plot)
+        # plot scripts may use the thrombin metrics, which import the figure runner
+        scheduler.add(os.path.join(dir, plot), dir, [[python, plot]], [plot] + [os.path.join(basedir, f) \
+            for f in ("Copasi.py", "thrombinMetrics.py", "figureRunner.py")] + ready, [], \
+            [os.path.join(dir, r) for r in ready])
+
+
+def isModelFile(fname):
+    """ Returns whether a new file could add a task to a model directory """
+    name = os.path.basename(fname)
+    return name.endswith(".cps") or (name.endswith(".xml") and not name.startswith(".")) or \
+        (name.startswith("plot") and name.endswith(".py")) or name == "figures.json"
+
+
+def printSummary(scheduler, status, models):
+    """ Prints the number of tasks by status and the failed ones by model, returns the latter """
+    print "Scheduled %d tasks of %d models:" % (len(status), len(models)),
+    print ", ".join(["%d %s" % (status.values().count(s), s) for s in \
+        ("done", "uptodate", "failed", "skipped") if s in status.values()])
+    failed = [name for name in scheduler.order if status[name] == "failed"]
+    for dir in models:
+        names = [name for name in failed if os.path.dirname(name) == dir]
+        if names:
+            print "  %s: failed %s" % (dir, ", ".join([os.path.basename(n) for n in names]))
+    return failed
+
+
+if __name__ == "__main__":
+    """
+    Makes the scheduler accessible to the command-line.
+    """
+    try:
+        args = sys.argv[1:]
+        options = {"-j" : "1", "-state" : None, "-python" : sys.executable, "-copasi" : "CopasiSE", \
+            "-cache" : None}
+        flags = {"-watch" : False, "-poll" : False}
+        while args and (args[0] in options or args[0] in flags):
+            if args[0] in flags:
+                flags[args[0]] = True
+                args = args[1:]
+            else:
+                options[args[0]] = args[1]
+                args = args[2:]
+        processes = int(options["-j"])
+        assert args
+    except Exception:
+        print __doc__
+        sys.exit(1)
+
+    scheduler = Scheduler(options["-state"], processes)
+    watcher, watched = None, None
+    try:
+        while True:
+            scheduler.clear()
+            models = findModels(args)
+            for dir in models:
+                addModel(scheduler, dir, options["-python"], options["-copasi"], options["-cache"])
+
+            if flags["-watch"]:
+                # the watcher is set up before the run and kept between runs so that changes
+                # made during one are not missed; it is only replaced if models were added or
+                # removed. Files written by the tasks themselves do not start a new run.
+                inputs = scheduler.files() - scheduler.files(outputs=True)
+                dirs = set([os.path.dirname(f) for f in inputs] + [os.path.abspath(d) for d in models])
+                if dirs != watched:
+                    if watcher:
+                        watcher.close()
+                    watcher, watched = createWatcher(dirs, flags["-poll"]), dirs
+
+            failed = printSummary(scheduler, scheduler.run(), models)
+            if not flags["-watch"]:
+                break
+
+            print "Watching %d files in %d directories for changes" % (len(inputs), len(dirs))
+            sys.stdout.flush()
+            changed = []
+            while not changed:
+                changed = [f for f in watcher.wait() if f in inputs or \
+                    (isModelFile(f) and f not in scheduler.files(outputs=True))]
+            print "=== changed %s" % ", ".join(sorted([os.path.relpath(f) for f in changed]))
+    except KeyboardInterrupt:
+        sys.exit(130)
+    if failed:
+        sys.exit(1)
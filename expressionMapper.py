@@ -18,23 +18,39 @@
 """
 Usage: ./expressionMapper -param value
     Parameters should be combined and are
-    -load <file>    : file to load lookup dictionary
+    -load <file>    : file to load lookup dictionary; can be repeated to merge
+                      several ones, duplicate rate laws are only kept once
     -query <idList> : comma-separated list of SBO Ids to query from webservice
+    -sbo <file>     : local SBO store or export to query instead of the webservice
     -save <file>    : file to save state of lookup dictionary
-    -map <SBML.xml> : filename of SBML file to map
-    -out <SBML.xml> : filename to save the mapped result
+    -map <SBML.xml> : filename of SBML file to map; can be repeated
+    -out <SBML.xml> : filename to save the mapped result; one per -map, in order
+    -outdir <dir>   : directory to save all mapped results under their own
+                      file names, instead of -out; created if missing, and
+                      the input file names must differ
+    -manifest <f>   : file with lines "<SBML.xml> <outfile>" to map, in addition
+                      to the -map parameters
     -initialise <f> : load a standard set of SBO Ids and save in file f;
-                      if used, this needs to be the first and only parameter
+                      if used, this needs to be the first parameter and can
+                      only be followed by -sbo
 
 Examples:
     ./expressionMapper.py -initialise MAMM.map
     Load a standard set of rate laws, namely all irreversible and reversible
     Mass Action kinetics, and Briggs-Haldane. Save them to the file MAMM.map.
 
+    ./expressionMapper.py -initialise MAMM.map -sbo SBO.store
+    The same, but query the local SBO store compiled by sboStore.py instead of
+    the webservice, so that no network connection is needed.
+
     ./expressionMapper.py -load MAMM.map -map SBML.xml -out SBML.sbo.xml
     Load set of rate laws saved in MAMM.map and assign SBO Terms in the SBML
     file SBML.xml matching these.
 
+    ./expressionMapper.py -load MAMM.map -map A.xml -map B.xml -outdir mapped
+    Load the rate laws once and map both A.xml and B.xml in the same process,
+    saving the results to mapped/A.xml and mapped/B.xml.
+
     ./expressionMapper.py -query 260,455,387 -map SBML.xml -out SBML.sbo.xml
     Load rate laws for simple competitive inhibition, substrate inhibition,
     and product inhibition, and assign SBO Terms in the file SBML.xml.
@@ -46,13 +62,18 @@ Examples:
 """
 
 import sys
+import os.path
 import itertools
 import re
-import cPickle as pickle
+import time
+from math import isinf, isnan
 from libsbml import *
-from sympy import Symbol
+from sympy import Symbol, Integer, Float, Rational, Function, Add, Mul, Pow, pi, E, oo, nan
 from xml.etree.ElementTree import ElementTree, fromstring, tostring
 from suds.client import Client
+from sboStore import SBOStore
+from lawLibrary import LawLibrary
+from telemetry import Stage, record, warn
 
 
 class ExpressionMatcher():
@@ -69,26 +90,35 @@ class ExpressionMatcher():
         self.mathns = "{http://www.w3.org/1998/Math/MathML}"
         self.types = ("reactant", "product", "modifier", "parameter")
         # map SBO Term Ids to a primitive data structure of their contents once fetched from server
-        self.sboLookup = []
+        self.sboLookup = LawLibrary()
         # also save concentration->participant lookups so we query only once
         self.childLookup = {}
+        # and reference expressions converted to sympy, by their infix notation
+        self.refExpressions = {}
+        # results of match() by the kinetic law and its terms, shared by all models mapped
+        self.matchCache = {}
+        # SBO term source, either the webservice or a local SBOStore
+        self.SBO = None
 
     def load(self, fname):
-        """ Loads a rate law lookup dictionary from a given file """
-        newLookup = pickle.load(open(fname, "rb"))
-        self.sboLookup += newLookup
-#        self.sboLookup.update(newLookup) # TODO: fix
+        """ Loads a rate law library from a given file, skipping laws that are present already """
+        self.sboLookup.load(fname)
 
     def save(self, fname):
-        """ Saves the lookup dictionary of rate laws to the given filename """
-        pickle.dump(self.sboLookup, open(fname, "wb"))
+        """ Saves the library of rate laws to the given filename """
+        self.sboLookup.save(fname)
+
+    def loadOntology(self, fname):
+        """ Uses a local SBO store or export file instead of the webservice for queries """
+        self.SBO = SBOStore(fname)
 
     def query(self, sboIdList):
-        """ Queries the SBO webservice for Ids """
-        client = Client("http://www.ebi.ac.uk/sbo/main/services/SBOQuery?wsdl")
-        self.SBO = client.service
+        """ Queries the SBO webservice, or the local store if loaded, for Ids """
+        if self.SBO is None:
+            client = Client("http://www.ebi.ac.uk/sbo/main/services/SBOQuery?wsdl")
+            self.SBO = client.service
         for id in sboIdList:
-            self.sboLookup.append(self._sboId2expression(id))
+            self.sboLookup.add(*self._sboId2expression(id))
 
     def addLaw(self, id, expr, termDict):
         """
@@ -99,7 +129,7 @@ class ExpressionMatcher():
         expr -- a string of the mathematical expression
         termDict -- a dictionary identifier:(type, parameter, participantRole)
         """
-        self.sboLookup.append((id, expr, termDict))
+        self.sboLookup.add(id, expr, termDict)
 
     def match(self, testSet, testExpr):
         """
@@ -110,14 +140,27 @@ class ExpressionMatcher():
         Takes
         testSet -- a tuple of referenced terms and their role in the kinetic law, e.g. reactant,
             product, or modifier.
-        testExpr -- an infix expression of the kinetic law with all its terms
+        testExpr -- a sympy expression of the kinetic law with all its terms as returned by
+            mathToExpression(), or its infix notation
 
         Returns: tuple of
         kineticLaw -- the SBO Id that was successfully mapped
         finalMap -- a dictionary of variable_name -> ("type", concentration, participant_role)
         or None if no mapping was found
         """
-        for kineticLaw, refExpr, termDict in self.sboLookup:
+        if isinstance(testExpr, basestring):
+            testExpr = mathToExpression(parseFormula(testExpr))[0]
+
+        key = testExpr, tuple(frozenset(terms) for terms in testSet)
+        if key not in self.matchCache:
+            self.matchCache[key] = self._matchLaws(testSet, testExpr)
+        return self.matchCache[key]
+
+    def _matchLaws(self, testSet, testExpr):
+        """ Matches the kinetic law to all laws in the library, see match() """
+        # only laws with the same number of terms of each type can match
+        signature = [len(terms) for terms in testSet]
+        for kineticLaw, refExpr, termDict in self.sboLookup.candidates(signature):
             refSet = (set(), set(), set(), set())
             for key, term in termDict.items():
                 for t in term[0].split(","):
@@ -143,29 +186,30 @@ class ExpressionMatcher():
         Takes:
         RPMKt -- reactants, products, modifiers, and parameters of the expression to be tested
         RPMKr -- reactants, products, modifiers, and parameters of the reference expression
-        testExpr -- the infix notation of the kinetic law formula, with terms defined in RPMKt
-        refExpr -- the formula derived from an SBO term with terms defined in RPMKr
+        testExpr -- the sympy expression of the kinetic law formula, with terms defined in RPMKt
+        refExpr -- the infix formula derived from an SBO term with terms defined in RPMKr
 
         Returns:
         varMap -- a dictionary mapping reference variables to test variables or None if no valid
             mapping is found
         """
         varMap = {}
-        symbolNamespace = {}
+        symbolMap = {}
 
         #test for equal amount of tokens with each type, otherwise return None right away
         for test,ref in zip((Rt,Pt,Mt,Kt), (Rr,Pr,Mr,Kr)):
             if len(test) != len(ref):
                 return None
 
-        # get all tokens in reference expression
-        for token in re.findall("[A-Za-z_]\w*", refExpr):
-            symbolNamespace[token] = Symbol(token)
+        # convert reference expression only once
+        if refExpr not in self.refExpressions:
+            self.refExpressions[refExpr] = mathToExpression(parseFormula(refExpr))[0]
+        refExpr = self.refExpressions[refExpr]
 
         # subroutine to assign current test permutation to ref vars
         def mapVars(testSymbols, refSymbols):
             for testSymbol, refSymbol in zip(testSymbols, refSymbols):
-                symbolNamespace[testSymbol] = symbolNamespace[refSymbol]
+                symbolMap[Symbol(testSymbol)] = Symbol(refSymbol)
                 varMap[refSymbol] = testSymbol
 
         # test for expression equality under permutations
@@ -177,9 +221,7 @@ class ExpressionMatcher():
                     mapVars(m, Mr)
                     for k in itertools.permutations(Kt):
                         mapVars(k, Kr)
-                   #    assert(eval(testExpr + "==" + testExpr, symbolNamespace)) # debug
-                   #    assert(eval(refExpr + "==" + refExpr, symbolNamespace)) # debug
-                        if eval(testExpr + "==" + refExpr, symbolNamespace):
+                        if testExpr.xreplace(symbolMap) == refExpr:
                             return varMap
 
         return None
@@ -236,6 +278,9 @@ class ExpressionMatcher():
         childId -- the SBO Id of the parameter, e.g. substrate/enzyme concentration, or quantitative parameter
         childRole -- the SBO Id of the parameter role, e.g. substrate/enzyme, or quantitative parameter
         """
+        if childId in self.childLookup:
+            return self.childLookup[childId]
+
         parameterRoots = (509, 512, 518, 2) # entities: concentrations of (reactant, product, modifier), parameter
         participantRoleRoots = (10, 11, 19) # references: r, p, m; mainly for debugging
         childRole = childId # role = id when there is no extra role
@@ -250,7 +295,8 @@ class ExpressionMatcher():
                         self.SBO.isChildOf(childRole, participantRoleRoots[num]))
                 break #TODO: this probably needs rewriting for multiple references
 
-        return (self.types[num], childId, childRole)
+        self.childLookup[childId] = (self.types[num], childId, childRole)
+        return self.childLookup[childId]
 
     def resolveFunction(self, lawExpr, function):
         """
@@ -265,30 +311,151 @@ class ExpressionMatcher():
         Returns:
         expr -- a mathematical expression where the function has been applied to the original one
         """
-        # replace function calls by their actual math (regex madness!)
-        for expr in re.findall("(?<=" + function.getId() + "\()[^)]+", lawExpr):
-            klmath, klbody = KineticLaw(2, 4), KineticLaw(2, 4)
-            klmath.setMath(function.getMath())
-            klbody.setMath(function.getBody())
-            functionVars = klmath.getFormula().replace(", " + klbody.getFormula(), "")
-            functionVars = re.search("(?<=lambda\()[^)]+", functionVars).group(0).split(", ")
-            newFunctionFormula = klbody.getFormula()
-            for repl, orig in zip(expr.split(", "), functionVars):
-                newFunctionFormula = re.sub("(?<!\w)" + orig + "(?!\w)", repl, newFunctionFormula)
-            lawExpr = lawExpr.replace(function.getId() + "(" + expr + ")", newFunctionFormula)
-        # return resolved expression
-        return lawExpr
-
-
-def simpletest():
+        return formulaToString(FunctionInliner([function]).inline(parseFormula(lawExpr)))
+
+
+class FunctionInliner():
+    def __init__(self, functions):
+        """
+        Sets up the inlining of calls to the given function definitions in math ASTs. The
+        lambda of each function is converted to a template of argument names and body once,
+        when it is first needed, and reused for every call.
+
+        Takes:
+        functions -- a list of libsbml FunctionDefinition objects, e.g. of a model
+        """
+        self.functions = dict((f.getId(), f) for f in functions)
+        # function Id -> (argument names, body AST with nested calls inlined)
+        self.templates = {}
+
+    def inline(self, math):
+        """
+        Returns a copy of a math AST where all calls to the functions are replaced by their
+        bodies with the arguments substituted. Nested calls are resolved as well.
+
+        Takes:
+        math -- a libsbml ASTNode, e.g. of a kinetic law
+        """
+        return self._inline(math.deepCopy())
+
+    def _template(self, name):
+        """ Returns the argument names and the inlined body of the function with the given Id """
+        if name not in self.templates:
+            function = self.functions[name]
+            self.templates[name] = None # guards against recursive definitions
+            args = [function.getArgument(i).getName() for i in range(function.getNumArguments())]
+            self.templates[name] = (args, self._inline(function.getBody().deepCopy()))
+        if self.templates[name] is None:
+            raise ValueError("recursive function definition: " + name)
+        return self.templates[name]
+
+    def _inline(self, node):
+        """ Inlines function calls in the AST node in place and returns the resulting node """
+        for i in range(node.getNumChildren()):
+            child = node.getChild(i)
+            newChild = self._inline(child)
+            if newChild is not child:
+                node.replaceChild(i, newChild, True)
+
+        if node.getType() == AST_FUNCTION and node.getName() in self.functions:
+            args, body = self._template(node.getName())
+            values = dict(zip(args, [node.getChild(i) for i in range(node.getNumChildren())]))
+            return self._substitute(body.deepCopy(), values)
+        return node
+
+    def _substitute(self, node, values):
+        """ Replaces the argument names in a copy of a function body by copies of the values """
+        if node.getType() == AST_NAME and node.getName() in values:
+            return values[node.getName()].deepCopy()
+        for i in range(node.getNumChildren()):
+            child = node.getChild(i)
+            newChild = self._substitute(child, values)
+            if newChild is not child:
+                node.replaceChild(i, newChild, True)
+        return node
+
+
+def mathToExpression(math, ones=()):
+    """
+    Converts a libsbml math AST to a sympy expression in a single traversal. Identifiers that
+    should not be considered, e.g. compartments, are replaced by 1 on the way, and all other
+    identifiers the expression references are collected. Calls of functions that are not
+    resolved are kept as undefined sympy functions of the same name.
+
+    Takes:
+    math -- a libsbml ASTNode, e.g. of a kinetic law with function calls inlined
+    ones -- a set of identifiers that are replaced by 1
+
+    Returns: tuple of
+    expr -- the sympy expression
+    symbols -- the set of identifiers referenced in expr
+    """
+    symbols = set()
+    operators = {AST_PLUS : Add, AST_TIMES : Mul, AST_POWER : Pow, AST_FUNCTION_POWER : Pow}
+    constants = {AST_CONSTANT_PI : pi, AST_CONSTANT_E : E}
+
+    def convert(node):
+        type = node.getType()
+        if type == AST_NAME or type == AST_NAME_TIME:
+            if node.getName() in ones:
+                return Integer(1)
+            symbols.add(node.getName())
+            return Symbol(node.getName())
+        elif type == AST_INTEGER:
+            return Integer(node.getInteger())
+        elif type in (AST_REAL, AST_REAL_E):
+            value = node.getReal()
+            if isnan(value):
+                return nan
+            elif isinf(value):
+                return oo if value > 0 else -oo
+            return Integer(int(value)) if value == int(value) else Float(value)
+        elif type == AST_RATIONAL:
+            return Rational(node.getNumerator(), node.getDenominator())
+        elif type in constants:
+            return constants[type]
+
+        args = [convert(node.getChild(i)) for i in range(node.getNumChildren())]
+        if type in operators:
+            return operators[type](*args)
+        elif type == AST_MINUS and len(args) in (1, 2):
+            return -args[0] if len(args) == 1 else args[0] - args[1]
+        elif type == AST_DIVIDE and len(args) == 2:
+            return args[0] / args[1]
+        else: # also malformed operators, which no rate law matches
+            return Function(node.getName() or node.getOperatorName())(*args)
+
+    return convert(math), symbols
+
+
+def mapFiles(em, files):
+    """
+    Annotates a number of SBML files with the same ExpressionMapper instance, so that the rate
+    law library is loaded and matches are cached only once for all of them.
+
+    Takes:
+    em -- an ExpressionMapper instance
+    files -- a list of (input, output) SBML file name tuples
+    """
+    for infile, outfile in files:
+        with Stage("sbo", infile):
+            doc = SBMLReader().readSBMLFromFile(infile)
+            annotateSBML(doc.getModel(), em)
+            writeSBMLToFile(doc, outfile)
+
+
+def simpletest(sboFile=None):
     """
     Tests the expression mapper by mapping the Briggs-Haldane rate law to a given expression 
-    and prints out the result.
+    and prints out the result. If an SBO store or export file is given, it is used as local
+    stand-in for the webservice.
     """
     testSet = (set(["substrate"]), set(), set(["enzyme"]), set(["kcat", "km"])) # reactants, products, modifiers, params
     testExpr = "kcat * enzyme * substrate / (km + substrate)"
     refLaws = [31]
     em = ExpressionMatcher()
+    if sboFile:
+        em.loadOntology(sboFile)
     em.query(refLaws)
     varMap = em.match(testSet, testExpr)
     print "Matching '", testExpr, "' to Briggs-Haldane", refLaws, "; resulting mapping:"
@@ -310,23 +477,16 @@ def annotateSBML(model, em):
     em -- an ExpressionMapper instance
     """
     # get list of compartments and functions for formula replacements
-    compartments = model.getListOfCompartments()
-    functions = model.getListOfFunctionDefinitions()
+    compartments = set([c.getId() for c in model.getListOfCompartments()])
+    inliner = FunctionInliner(model.getListOfFunctionDefinitions())
 
     for reaction in model.getListOfReactions():
         law = reaction.getKineticLaw()
-        testExpr = law.getFormula()
-
-        # as we are not interested in compartments when matching formulas, replace all occurences by "1"
-        for c in compartments:
-            testExpr = testExpr.replace(c.getId(), "1")
 
-        # replace function calls by their actual math
-        for f in functions:
-            testExpr = em.resolveFunction(testExpr, f)
-
-        # get all variables that are referenced in the final formula
-        inFormula = set(re.findall("[A-Za-z_]\w*", testExpr))
+        # replace function calls by their actual math and get all variables that are referenced
+        # in the final formula; as we are not interested in compartments when matching formulas,
+        # all their occurences are replaced by 1
+        testExpr, inFormula = mathToExpression(inliner.inline(law.getMath()), compartments)
 
         # create a list of participant sets (reactants, products, modifiers, parameters)
         reactionRPM = reaction.getListOfReactants, reaction.getListOfProducts, reaction.getListOfModifiers
@@ -336,11 +496,13 @@ def annotateSBML(model, em):
         testSet.append(inFormula ^ (testSet[0] | testSet[1] | testSet[2]))
 
         # do matching
+        start = time.time()
         result = em.match(testSet, testExpr)
+        record("match", reaction=reaction.getId(), seconds=time.time() - start, matched=result != None)
 #        print reaction.getName(), result
         if result == None: 
             # warn if no match obtained
-            print "*** WARN: *** Could not map:", reaction.getId(), testExpr, testSet
+            warn("Could not map:", reaction.getId(), testExpr, testSet)
         else:
             # otherwise, set corresponding SBO term to rate law...
             law.setSBOTerm(result[0])
@@ -356,7 +518,7 @@ def annotateSBML(model, em):
                     if param == None:
                         oldTerm = model.getParameter(identifier).getSBOTerm()
                         if oldTerm != -1 and oldTerm != role:
-                            print "*** WARN: *** overwriting", oldTerm, "with", role # not sure if it should get LCA here
+                            warn("overwriting", oldTerm, "with", role) # not sure if it should get LCA here
                         model.getParameter(identifier).setSBOTerm(role)
                     else:
                         param.setSBOTerm(role)
@@ -375,10 +537,11 @@ if __name__ == "__main__":
 
     try:
         if sys.argv[1] == "-test":
-            simpletest()
+            simpletest(*sys.argv[2:3])
             sys.exit(0)
 
-        params = {'-load':[], '-query':[], '-save':[], '-map':[], '-out':[]}
+        params = {'-load':[], '-query':[], '-sbo':[], '-save':[], '-map':[], '-out':[], \
+            '-outdir':[], '-manifest':[]}
         if len(sys.argv) < 3:
             raise AssertionError
 
@@ -424,23 +587,49 @@ if __name__ == "__main__":
                                        59, 111, 112, 114, 115, 117, 118, 119,
                                        61, 121, 122, 124, 125, 127, 128, 129""")
             params['-save'].append(sys.argv[2])
+            if sys.argv[3:4] == ["-sbo"]:
+                params['-sbo'].append(sys.argv[4])
         else:
             for i in range(1, len(sys.argv), 2):
                 params[sys.argv[i]].append(sys.argv[i+1])
+
+        # pair input and output files
+        if params['-outdir']:
+            outdir = params['-outdir'][-1]
+            files = [(map, os.path.join(outdir, os.path.basename(map))) for map in params['-map']]
+        elif len(params['-map']) == len(params['-out']):
+            files = zip(params['-map'], params['-out'])
+        else:
+            raise AssertionError
+        for manifest in params['-manifest']:
+            for line in open(manifest):
+                if line.strip() and not line.startswith("#"):
+                    infile, outfile = line.split()
+                    files.append((infile, outfile))
     except Exception:
         print __doc__
         sys.exit(1)
 
+    # several inputs with the same file name would overwrite each other in -outdir
+    targets = {}
+    for infile, outfile in files:
+        targets.setdefault(os.path.abspath(outfile), []).append(infile)
+    clashes = sorted([(outfile, infiles) for outfile, infiles in targets.items() if len(infiles) > 1])
+    for outfile, infiles in clashes:
+        print "Files %s would all be saved as %s" % (", ".join(infiles), outfile)
+    if clashes:
+        sys.exit(1)
+    for outfile in targets:
+        if not os.path.isdir(os.path.dirname(outfile)):
+            os.makedirs(os.path.dirname(outfile))
+
     for load in params['-load']:
         em.load(load)
+    for sbo in params['-sbo']:
+        em.loadOntology(sbo)
     for query in params['-query']:
         em.query([int(id.strip()) for id in query.split(",")])
     for save in params['-save']:
         em.save(save)
-    for map in params['-map']:
-        doc = SBMLReader().readSBMLFromFile(map)
-        model = doc.getModel()
-        annotateSBML(model, em)
-    for out in params['-out']:
-        writeSBMLToFile(doc, out)
+    mapFiles(em, files)
 
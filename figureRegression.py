@@ -0,0 +1,208 @@
+#!/usr/bin/env python2.7
+#
+# FigureRegression checks that models still reproduce the curves of their figures.
+# - written by Michael Schubert, EMBL-EBI, 2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Usage: ./figureRegression.py -record|-check -param value ... <spec|dir> [<spec|dir> ...]
+    <spec>      : JSON figure specification, as for figureRunner.py
+    <dir>       : directory to search for figures.json files, including its
+                  subdirectories
+    -record     : simulate all figures and store their curves as reference
+    -check      : simulate all figures and compare their curves to the
+                  reference; the exit code is 1 if one deviates or is missing
+    -j <n>      : number of processes to simulate with, default 1
+    -cache <dir>: directory of the simulation cache of figureRunner.py; leave
+                  it out to check a new version of Copasi, which the cache
+                  does not tell apart
+
+Examples:
+    ./figureRegression.py -record -j 4 .
+    Stores the curves of all figures below the current directory, one
+    compressed figures.reference.npz next to each figures.json.
+
+    ./figureRegression.py -check -j 4 .
+    Simulates all scenarios of all models in one batch, interpolates the
+    curves onto the time points of their reference and lists those that
+    deviate by more than their tolerance, with the maximum deviation and
+    where it occurs.
+
+A curve deviates at a point if |new - reference| > atol + rtol * |reference|.
+Observables can set "rtol" and "atol" in the figure specification, or the
+axes for all of their observables. The default rtol is 1e-3, the default
+atol 1e-6 times the largest absolute value of the reference curve.
+"""
+
+import sys
+import os
+import hashlib
+import numpy as np
+from figureRunner import evaluate, findSpecs, loadFigures, scenarioKey, collectScenarios, \
+    simulateAll, SimulationCache
+
+defaultRtol = 1e-3
+defaultAtolScale = 1e-6
+
+
+def referenceFile(spec):
+    """ Returns the name of the reference file of a specification file """
+    return os.path.splitext(spec)[0] + ".reference.npz"
+
+
+def curveGroups(figures, results):
+    """
+    Returns a dict of specification file -> list of the curves of its figures, grouped by
+    scenario as (scenario id, x values, [(curve id, y values, observable, axes, description)])
+    so that all curves of a scenario share their x values. Scenarios that were not
+    simulated have None as x values.
+    """
+    groups = {}
+    for figure in figures:
+        model = os.path.basename(figure["model"])
+        for axes in figure["axes"]:
+            xExpr = axes.get("x", "Time")
+            for scenario in axes["scenarios"]:
+                key = scenarioKey(scenario)
+                data = results.get((figure["model"], key))
+                sid = hashlib.sha1(repr((model, key, xExpr))).hexdigest()[:16]
+                curves = []
+                for observable in axes.get("observables", []):
+                    cid = sid + "_" + hashlib.sha1(observable["y"]).hexdigest()[:8]
+                    desc = "%s: %s %s" % (os.path.basename(figure["output"]), \
+                        scenario.get("label") or model, observable.get("label") or observable["y"])
+                    y = None if data is None else np.asarray(evaluate(observable["y"], data), dtype=float)
+                    curves.append((cid, y, observable, axes, desc))
+                x = None if data is None else np.asarray(evaluate(xExpr, data), dtype=float)
+                groups.setdefault(figure["spec"], []).append((sid, x, curves))
+    return groups
+
+
+def recordReferences(groups):
+    """ Stores the curves of each specification file in its reference file, returns the number of curves """
+    count = 0
+    for spec, scenarios in sorted(groups.items()):
+        arrays = {}
+        for sid, x, curves in scenarios:
+            if x is None:
+                raise ValueError("%s: not all scenarios could be simulated" % spec)
+            arrays[sid] = x
+            for cid, y, observable, axes, desc in curves:
+                arrays[cid] = y
+        np.savez_compressed(referenceFile(spec), **arrays)
+        count += len(arrays)
+        print "Recorded %d arrays in %s" % (len(arrays), referenceFile(spec))
+    return count
+
+
+def interpolate(x, Y, grid):
+    """
+    Returns the rows of Y, given at the increasing points x, linearly interpolated onto
+    the points of grid; like numpy.interp, but for all rows at once
+    """
+    i = np.clip(np.searchsorted(x, grid, side="right") - 1, 0, len(x) - 2)
+    dx = x[i + 1] - x[i]
+    w = np.clip(np.where(dx > 0, (grid - x[i]) / np.where(dx > 0, dx, 1), 0), 0, 1)
+    # points of x itself only take their own value, so that a NaN does not spread to its neighbours
+    return Y[:, i] * (1 - w) + np.where(w > 0, Y[:, i + 1] * w, 0)
+
+
+def compareScenario(x, Y, refX, refY, rtol, atol):
+    """
+    Compares the curves of one scenario to their reference
+
+    Takes:
+    x, Y -- the new x values and the new curves as rows
+    refX, refY -- the x values and curves of the reference
+    rtol, atol -- arrays of the tolerances of each curve
+
+    Returns:
+    arrays of whether each curve deviates, its largest deviation, the x value where it
+    occurs, and that deviation relative to the tolerance there
+    """
+    new = interpolate(x, Y, refX)
+    deviation = np.abs(new - refY)
+    allowed = atol[:, None] + rtol[:, None] * np.abs(refY)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(deviation == 0, 0, deviation / allowed)
+    ratio[np.isnan(ratio)] = np.inf # the new curve is not a number there
+    worst = np.argmax(ratio, axis=1)
+    rows = np.arange(len(Y))
+    failed = (ratio[rows, worst] > 1) | (x[0] > refX[0]) | (x[-1] < refX[-1])
+    return failed, deviation[rows, worst], refX[worst], ratio[rows, worst]
+
+
+def checkReferences(groups):
+    """ Compares all curves to their reference and prints those that deviate, returns their number """
+    checked, failures = 0, []
+    for spec, scenarios in sorted(groups.items()):
+        fname = referenceFile(spec)
+        reference = np.load(fname) if os.path.exists(fname) else None
+        try:
+            for sid, x, curves in scenarios:
+                checked += len(curves)
+                if x is None:
+                    failures += ["%s: not simulated" % c[4] for c in curves]
+                    continue
+                hasReference = reference is not None and sid in reference
+                known = [c for c in curves if hasReference and c[0] in reference]
+                failures += ["%s: no reference" % c[4] for c in curves if not (hasReference and c[0] in reference)]
+                if not known:
+                    continue
+                refX = reference[sid]
+                refY = np.array([reference[c[0]] for c in known])
+                rtol = np.array([float(c[2].get("rtol", c[3].get("rtol", defaultRtol))) for c in known])
+                atol = np.array([float(c[2].get("atol", c[3].get("atol", defaultAtolScale * \
+                    np.abs(refY[i]).max()))) for i, c in enumerate(known)])
+                failed, deviation, where, ratio = compareScenario(x, np.array([c[1] for c in known]), \
+                    refX, refY, rtol, atol)
+                for i in np.flatnonzero(failed):
+                    failures.append("%s: deviates by %g at x = %g, %.3g times the tolerance" % \
+                        (known[i][4], deviation[i], where[i], ratio[i]))
+        finally:
+            if reference is not None:
+                reference.close()
+
+    for failure in failures:
+        print "  " + failure
+    print "Checked %d curves of %d figure specifications: %d failed" % (checked, len(groups), len(failures))
+    return len(failures)
+
+
+if __name__ == "__main__":
+    """
+    Makes the regression check accessible to the command-line.
+    """
+    try:
+        args = sys.argv[1:]
+        mode = args.pop(0)
+        assert mode in ("-record", "-check")
+        options = {"-j" : "1", "-cache" : None}
+        while args and args[0] in options:
+            options[args[0]] = args[1]
+            args = args[2:]
+        processes = int(options["-j"])
+        specs = findSpecs(args)
+        assert specs
+    except Exception:
+        print __doc__
+        sys.exit(1)
+
+    figures = loadFigures(specs)
+    cache = SimulationCache(options["-cache"]) if options["-cache"] else None
+    groups = curveGroups(figures, simulateAll(collectScenarios(figures), cache, processes))
+    if mode == "-record":
+        recordReferences(groups)
+    elif checkReferences(groups):
+        sys.exit(1)
@@ -0,0 +1,334 @@
+#!/usr/bin/env python2.7
+#
+# FigureRunner simulates models and plots figures as described in JSON specifications.
+# - written by Michael Schubert, EMBL-EBI, 2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Usage: ./figureRunner.py -param value ... <spec|dir> [<spec|dir> ...]
+    <spec>      : JSON file that specifies figures, see below
+    <dir>       : directory to search for figures.json files, including its
+                  subdirectories
+    -j <n>      : number of processes to simulate and render with, default 1
+    -cache <dir>: directory to keep the simulated time courses in, keyed by the
+                  hash of the model file, the simulation code and the
+                  scenario; default none
+
+Examples:
+    ./figureRunner.py -j 4 -cache .cache .
+    Collects the scenarios of all figures below the current directory,
+    simulates each distinct one once unless it is in the cache, and then
+    renders the figures with up to 4 processes.
+
+A specification lists figures, each with the model file to simulate and the
+axes to draw, relative to the specification file:
+    {"figures" : [{
+        "model" : "Hockin2002.xml",
+        "output" : "Hockin2002.png",
+        "axes" : [{
+            "end" : 700, "steps" : 350,
+            "scenarios" : [{"init" : {"TF" : 25e-12}, "label" : "25 pM"},
+                           {"init" : {"TF" : "5 * 1e-12"}, "label" : "5 pM"}],
+            "observables" : [{"y" : "IIa + 1.2 * mIIa"}],
+            "title" : "Total thrombin", "xlabel" : "Time (sec)",
+            "xlim" : [0, 700], "legend" : {"loc" : 2}
+        }]
+    }]}
+
+Every observable is plotted for every scenario of its axes. A scenario sets the
+"init" concentrations and "parameters" given, all others keep their value
+from the model, and is simulated until "end" in "steps" steps; these two can
+be given for all scenarios of the axes as well. Observables, the "x" value
+(default "Time"), and initial values are Python expressions of the simulated
+species and pi, exp, log and sqrt. Axes may further have a "position" in
+figure coordinates for insets, "ylabel", "ylim", "xticks" and "yticks", and
+"legend" with the arguments to matplotlib's legend(). Observables and axes may
+set the "rtol" and "atol" that figureRegression.py checks them with.
+"""
+
+import sys
+import os
+import json
+import hashlib
+import tempfile
+from multiprocessing import Pool
+import numpy as np
+import matplotlib
+matplotlib.use("Agg") # before pyplot is imported, so that no display is needed
+import matplotlib.pyplot as plt
+from telemetry import Stage, warn
+
+# names that expressions in specifications can use besides the simulated species
+namespace = {"__builtins__" : {}, "pi" : np.pi, "exp" : np.exp, "log" : np.log, "sqrt" : np.sqrt}
+cacheVersion = 1
+
+
+def evaluate(expr, data={}):
+    """ Returns a number, or the value of an expression of the simulated time courses """
+    if not isinstance(expr, basestring):
+        return expr
+    return eval(expr, namespace, data)
+
+
+def findSpecs(paths):
+    """ Returns the given specification files and the figures.json files in the given directories """
+    specs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in sorted(os.walk(path)):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                if "figures.json" in files:
+                    specs.append(os.path.join(root, "figures.json"))
+        else:
+            specs.append(path)
+    return specs
+
+
+def loadFigures(specs):
+    """
+    Returns the figures of the specification files with absolute file names, and with
+    the scenarios of all axes completed and their initial values evaluated
+    """
+    figures = []
+    for fname in specs:
+        dir = os.path.dirname(os.path.abspath(fname))
+        for figure in json.load(open(fname))["figures"]:
+            figure["model"] = os.path.join(dir, figure["model"])
+            figure["output"] = os.path.join(dir, figure["output"])
+            figure["spec"] = os.path.abspath(fname)
+            for axes in figure["axes"]:
+                scenarios = []
+                for given in axes.get("scenarios", [{}]):
+                    scenario = {"end" : axes.get("end"), "steps" : axes.get("steps")}
+                    scenario.update(given)
+                    for kind in ("init", "parameters"):
+                        scenario[kind] = dict([(name, float(evaluate(value))) for name, value \
+                            in scenario.get(kind, {}).items()])
+                    if scenario["end"] is None or scenario["steps"] is None:
+                        raise ValueError("%s: scenario without end or steps in %s" % (fname, figure["output"]))
+                    scenarios.append(scenario)
+                axes["scenarios"] = scenarios
+            figures.append(figure)
+    return figures
+
+
+def scenarioKey(scenario):
+    """ Returns the string that identifies the simulation of a scenario """
+    return json.dumps([scenario["init"], scenario["parameters"], scenario["end"], scenario["steps"]], \
+        sort_keys=True)
+
+
+def collectScenarios(figures):
+    """ Returns a dict of model file -> list of the distinct scenario keys of all figures """
+    batch = {}
+    for figure in figures:
+        keys = batch.setdefault(figure["model"], [])
+        for axes in figure["axes"]:
+            for scenario in axes["scenarios"]:
+                key = scenarioKey(scenario)
+                if key not in keys:
+                    keys.append(key)
+    return batch
+
+
+class SimulationCache:
+    """
+    Keeps simulated time courses as .npz files, under the hash of the model file, the
+    simulator code and the scenario.
+
+    Takes:
+    dir -- the directory to keep the files in
+    """
+    def __init__(self, dir):
+        self.dir = dir
+        # model file -> hash of the model and the simulator code
+        self.hashes = {}
+
+    def filename(self, model, key):
+        if model not in self.hashes:
+            sha = hashlib.sha1()
+            basedir = os.path.dirname(os.path.abspath(__file__))
+            # this file sets up the scenarios in simulateModel() before Copasi runs them
+            for fname in [model] + [os.path.join(basedir, f) for f in ("figureRunner.py", "Copasi.py")]:
+                sha.update(open(fname, "rb").read())
+            self.hashes[model] = sha.hexdigest()
+        sha = hashlib.sha1("%d %s %s" % (cacheVersion, self.hashes[model], key))
+        return os.path.join(self.dir, sha.hexdigest() + ".npz")
+
+    def load(self, model, key):
+        """ Returns the dict of time courses of a scenario, or None if it is not in the cache """
+        fname = self.filename(model, key)
+        if not os.path.exists(fname):
+            return None
+        npz = np.load(fname)
+        try:
+            return dict(zip([str(name) for name in npz["names"]], npz["values"]))
+        finally:
+            npz.close()
+
+    def save(self, model, key, data):
+        """ Stores the dict of time courses of a scenario """
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+        names = sorted(data)
+        fd, tmp = tempfile.mkstemp(dir=self.dir, suffix=".npz")
+        out = os.fdopen(fd, "wb")
+        np.savez(out, names=np.array(names), values=np.array([data[name] for name in names]))
+        out.close()
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0666 & ~umask) # mkstemp creates the file readable by the owner only
+        os.rename(tmp, self.filename(model, key))
+
+
+def simulateModel(job):
+    """
+    Simulates the scenarios of one model, returns the model file, the list of dicts of
+    time courses, and an error message or None. Needs a process of its own, as Copasi
+    can only hold one model per process.
+    """
+    model, keys = job
+    try:
+        from Copasi import CopasiSimulator # only the simulating processes need Copasi
+        sim = CopasiSimulator(model)
+        accessors = {"init" : (sim.getInitialConcentration, sim.setInitialConcentration), \
+            "parameters" : (sim.getParameter, sim.setParameter)}
+        # model values of everything a scenario changed, to reset it for the next ones
+        original = {"init" : {}, "parameters" : {}}
+        results = []
+        for key in keys:
+            init, parameters, end, steps = json.loads(key)
+            for kind, values in (("init", init), ("parameters", parameters)):
+                getter, setter = accessors[kind]
+                original[kind].update(getter([name for name in values if name not in original[kind]]))
+                reset = dict(original[kind])
+                reset.update(values)
+                if reset:
+                    setter(reset)
+            results.append(sim.doTimecourse(end, steps))
+        return model, results, None
+    except Exception, e:
+        return model, [], "%s: %s" % (e.__class__.__name__, e)
+
+
+def simulateAll(batch, cache=None, processes=1):
+    """
+    Returns a dict of (model file, scenario key) -> dict of time courses for all scenarios
+    of a batch, simulating those that are not in the cache with one process per model
+    """
+    results = {}
+    jobs = []
+    for model, keys in sorted(batch.items()):
+        missing = []
+        for key in keys:
+            data = cache.load(model, key) if cache else None
+            if data is None:
+                missing.append(key)
+            else:
+                results[(model, key)] = data
+        if missing:
+            jobs.append((model, missing))
+
+    restored = len(results)
+    if jobs:
+        pool = Pool(min(processes, len(jobs)), maxtasksperchild=1)
+        for model, courses, error in pool.imap_unordered(simulateModel, jobs):
+            if error:
+                warn("Could not simulate", model + ":", error)
+            for key, data in zip(dict(jobs)[model], courses):
+                results[(model, key)] = data
+                if cache:
+                    cache.save(model, key, data)
+        pool.close()
+        pool.join()
+
+    print "Simulated %d and restored %d of %d scenarios of %d models" % (len(results) - restored, \
+        restored, sum([len(keys) for keys in batch.values()]), len(batch))
+    return results
+
+
+def renderFigure(job):
+    """ Draws a figure from the time courses of its scenarios, returns its file and an error or None """
+    figure, courses = job
+    try:
+        with Stage("render", figure["output"]):
+            fig = plt.figure()
+            for axes, data in zip(figure["axes"], courses):
+                ax = fig.add_axes(axes["position"]) if "position" in axes else fig.add_subplot(111)
+                for scenario, values in zip(axes["scenarios"], data):
+                    x = evaluate(axes.get("x", "Time"), values)
+                    for observable in axes.get("observables", []):
+                        label = " ".join([l for l in (scenario.get("label"), observable.get("label")) if l])
+                        ax.plot(x, evaluate(observable["y"], values), label=label or None)
+                for name in ("title", "xlabel", "ylabel", "xlim", "ylim", "xticks", "yticks"):
+                    if name in axes:
+                        getattr(ax, "set_" + name)(axes[name])
+                if "legend" in axes:
+                    ax.legend(**axes["legend"])
+            fig.savefig(figure["output"])
+            plt.close(fig)
+        return figure["output"], None
+    except Exception, e:
+        return figure["output"], "%s: %s" % (e.__class__.__name__, e)
+
+
+def renderAll(figures, results, processes=1):
+    """ Renders all figures whose scenarios were simulated, returns the files that could not be """
+    jobs, failed = [], []
+    for figure in figures:
+        courses = [[results.get((figure["model"], scenarioKey(s))) for s in axes["scenarios"]] \
+            for axes in figure["axes"]]
+        if None in sum(courses, []):
+            failed.append(figure["output"])
+        else:
+            jobs.append((figure, courses))
+
+    if processes > 1 and len(jobs) > 1:
+        pool = Pool(min(processes, len(jobs)))
+        rendered = pool.map(renderFigure, jobs)
+        pool.close()
+        pool.join()
+    else:
+        rendered = map(renderFigure, jobs)
+
+    for output, error in rendered:
+        if error:
+            warn("Could not render", output + ":", error)
+            failed.append(output)
+    print "Rendered %d of %d figures" % (len(figures) - len(failed), len(figures))
+    return failed
+
+
+if __name__ == "__main__":
+    """
+    Makes the figure runner accessible to the command-line.
+    """
+    try:
+        args = sys.argv[1:]
+        options = {"-j" : "1", "-cache" : None}
+        while args and args[0] in options:
+            options[args[0]] = args[1]
+            args = args[2:]
+        processes = int(options["-j"])
+        assert args
+        specs = findSpecs(args)
+    except Exception:
+        print __doc__
+        sys.exit(1)
+
+    figures = loadFigures(specs)
+    cache = SimulationCache(options["-cache"]) if options["-cache"] else None
+    results = simulateAll(collectScenarios(figures), cache, processes)
+    if renderAll(figures, results, processes):
+        sys.exit(1)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python2.7
+#
+# FileWatcher waits for files in a set of directories to change.
+# - written by Michael Schubert, EMBL-EBI, 2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Usage: ./fileWatcher.py [-poll] <dir> [<dir> ...]
+    <dir>  : directory whose files to watch, not including subdirectories
+    -poll  : compare modification times instead of using inotify
+
+Examples:
+    ./fileWatcher.py . Bungay2003
+    Prints the names of the files that are written, moved or deleted in the
+    current directory and Bungay2003 until interrupted.
+"""
+
+import sys
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from telemetry import warn
+
+
+class InotifyWatcher:
+    """
+    Watches directories with the Linux inotify interface through ctypes. Directories are
+    watched instead of files, as editors often save a file by writing a new one and moving
+    it over the old one.
+
+    Takes:
+    dirs -- the directories to watch
+    settle -- seconds without further changes before they are returned
+    """
+    # inotify_event: watch descriptor, mask, cookie, length of the name that follows
+    eventHeader = struct.Struct("iIII")
+    # IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+    mask = 0x08 | 0x40 | 0x80 | 0x200
+
+    def __init__(self, dirs, settle=0.2):
+        self.settle = settle
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.dirs = {}
+        for dir in set([os.path.abspath(d) for d in dirs]):
+            wd = libc.inotify_add_watch(self.fd, dir, self.mask)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed", dir)
+            self.dirs[wd] = dir
+
+    def wait(self, timeout=None):
+        """ Returns the set of files that changed, waiting for the first at most timeout seconds """
+        changed = set()
+        while self._poll(timeout):
+            changed |= self._read()
+            if changed:
+                timeout = self.settle
+        return changed
+
+    def _poll(self, timeout):
+        while True:
+            try:
+                return select.select([self.fd], [], [], timeout)[0]
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def _read(self):
+        data = os.read(self.fd, 65536)
+        changed = set()
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = self.eventHeader.unpack_from(data, pos)
+            pos += self.eventHeader.size
+            name = data[pos:pos + length].rstrip("\0")
+            pos += length
+            if wd in self.dirs and name:
+                changed.add(os.path.join(self.dirs[wd], name))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Watches directories by comparing the modification times and sizes of their files,
+    for systems without inotify.
+
+    Takes:
+    dirs -- the directories to watch
+    interval -- seconds between two comparisons
+    """
+    def __init__(self, dirs, interval=1.0):
+        self.dirs = set([os.path.abspath(d) for d in dirs])
+        self.interval = interval
+        self.files = self._scan()
+
+    def _scan(self):
+        files = {}
+        for dir in self.dirs:
+            for name in os.listdir(dir):
+                fname = os.path.join(dir, name)
+                try:
+                    stat = os.stat(fname)
+                except OSError:
+                    continue # deleted meanwhile
+                files[fname] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def wait(self, timeout=None):
+        """ Returns the set of files that changed, waiting for the first at most timeout seconds """
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            time.sleep(self.interval if end is None else max(0, min(self.interval, end - time.time())))
+            files = self._scan()
+            changed = set([f for f in set(files) | set(self.files) if files.get(f) != self.files.get(f)])
+            self.files = files
+            if changed or (end is not None and time.time() >= end):
+                return changed
+
+    def close(self):
+        pass
+
+
+def createWatcher(dirs, poll=False):
+    """ Returns an InotifyWatcher for the directories, or a PollingWatcher if that is not available """
+    if not poll:
+        try:
+            return InotifyWatcher(dirs)
+        except (OSError, AttributeError), e: # AttributeError: no inotify in the C library
+            warn("inotify not available, polling for changes instead:", e)
+    return PollingWatcher(dirs)
+
+
+if __name__ == "__main__":
+    """
+    Makes the watcher accessible to the command-line.
+    """
+    args = sys.argv[1:]
+    poll = args[:1] == ["-poll"]
+    dirs = args[poll:]
+    if not dirs:
+        print __doc__
+        sys.exit(1)
+
+    watcher = createWatcher(dirs, poll)
+    try:
+        while True:
+            for fname in sorted(watcher.wait()):
+                print fname
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        watcher.close()
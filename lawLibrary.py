@@ -0,0 +1,178 @@
+#!/usr/bin/env python2.7
+#
+# LawLibrary stores the rate laws used by the ExpressionMatcher.
+# - written by Michael Schubert, EMBL-EBI, 2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Usage: ./lawLibrary.py <outfile> <infile> [<infile> ...]
+    Parameters are all mandatory
+    <outfile> : file name to save the merged library
+    <infile>  : rate law libraries to merge, in either the current or the
+                old pickled list format
+
+Examples:
+    ./lawLibrary.py MAMM.map MAMM.map custom.map
+    Merges the rate laws of custom.map into MAMM.map, dropping duplicates.
+
+File format:
+    A header line with the format name and version, followed by one pickled
+    record per rate law, the pickled index of (signature, digest, offset) of
+    every record and an 8 byte offset of that index at the very end. The
+    signature of a law is the number of reactants, products, modifiers, and
+    parameters it references; only laws with the same signature as a kinetic
+    law can match it, so only those are read from disk.
+"""
+
+import sys
+import struct
+import hashlib
+import cPickle as pickle
+
+
+class LawLibrary:
+    """
+    Ordered, duplicate-free collection of (SBO Id, expression, termDict) rate laws
+    that are loaded from disk lazily by their signature.
+    """
+    magic = "RATELAWLIB"
+    version = 1
+    types = ("reactant", "product", "modifier", "parameter")
+
+    def __init__(self, fname=None):
+        """
+        Initialises an empty library, or loads the one in the file name given
+        """
+        # law digest -> (SBO Id, expression, termDict), once loaded
+        self.laws = {}
+        # law digest -> (file, offset) of laws that have not been loaded yet
+        self.pending = {}
+        # signature -> list of law digests, in the order they were added
+        self.index = {}
+        self.order = []
+        if fname:
+            self.load(fname)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        """ Iterates over all laws in the order they were added, loading them if needed """
+        for digest in self.order:
+            yield self._get(digest)
+
+    def signature(self, termDict):
+        """
+        Returns the number of reactants, products, modifiers, and parameters in a termDict,
+        where a term of the type "reactant,product" counts as both.
+        """
+        counts = [0] * len(self.types)
+        for term in termDict.values():
+            for t in term[0].split(","):
+                counts[self.types.index(t)] += 1
+        return tuple(counts)
+
+    def digest(self, id, expr, termDict):
+        """ Returns a key that is identical for duplicate laws """
+        return hashlib.sha1(repr((id, "".join(expr.split()), sorted(termDict.items())))).digest()
+
+    def add(self, id, expr, termDict):
+        """
+        Adds a rate law unless the same one is in the library already
+
+        Returns:
+        added -- True if the law was added, False if it was a duplicate
+        """
+        digest = self.digest(id, expr, termDict)
+        if digest in self.laws or digest in self.pending:
+            return False
+        self.laws[digest] = (id, expr, termDict)
+        self._register(self.signature(termDict), digest)
+        return True
+
+    def merge(self, other):
+        """ Adds all laws of another library that are not in this one already """
+        for law in other:
+            self.add(*law)
+
+    def candidates(self, signature):
+        """
+        Returns all laws with the given signature, loading only these from disk
+
+        Takes:
+        signature -- tuple of the number of reactants, products, modifiers, and parameters
+        """
+        return [self._get(digest) for digest in self.index.get(tuple(signature), [])]
+
+    def load(self, fname):
+        """
+        Loads the header and signature index of a library file, or all laws of a file
+        in the old pickled list format, and adds the ones that are not present already.
+        """
+        f = open(fname, "rb")
+        if f.readline().split() != [self.magic, str(self.version)]:
+            f.seek(0)
+            for law in pickle.load(f):
+                self.add(*law)
+            return
+        f.seek(-8, 2)
+        f.seek(struct.unpack("<Q", f.read(8))[0])
+        for signature, digest, offset in pickle.load(f):
+            if digest not in self.laws and digest not in self.pending:
+                self.pending[digest] = (f, offset)
+                self._register(signature, digest)
+
+    def save(self, fname):
+        """ Saves all laws and the signature index to the given file name """
+        for law in self: # read everything before we possibly overwrite our source
+            pass
+        f = open(fname, "wb")
+        f.write("%s %d\n" % (self.magic, self.version))
+        index = []
+        for digest in self.order:
+            law = self.laws[digest]
+            index.append((self.signature(law[2]), digest, f.tell()))
+            pickle.dump(law, f, pickle.HIGHEST_PROTOCOL)
+        indexOffset = f.tell()
+        pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+        f.write(struct.pack("<Q", indexOffset))
+        f.close()
+
+    def _register(self, signature, digest):
+        """ Adds a law digest to the signature index """
+        self.index.setdefault(signature, []).append(digest)
+        self.order.append(digest)
+
+    def _get(self, digest):
+        """ Returns a law, reading its record from disk if it was not loaded yet """
+        if digest not in self.laws:
+            f, offset = self.pending.pop(digest)
+            f.seek(offset)
+            self.laws[digest] = pickle.load(f)
+        return self.laws[digest]
+
+
+if __name__ == "__main__":
+    """
+    Makes merging of libraries accessible to the command-line.
+    """
+    if len(sys.argv) < 3:
+        print __doc__
+        sys.exit(1)
+
+    library = LawLibrary()
+    for fname in sys.argv[2:]:
+        library.load(fname)
+    library.save(sys.argv[1])
+    print "Saved", len(library), "rate laws to", sys.argv[1]
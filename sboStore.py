@@ -0,0 +1,175 @@
+#!/usr/bin/env python2.7
+#
+# SBOStore is an offline replacement for the SBO webservice.
+# - written by Michael Schubert, EMBL-EBI, 2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Usage: ./sboStore.py <dump> <store>
+    Parameters are both mandatory
+    <dump>  : SBO export, either the XML dump (SBO_XML.xml) or OBO (SBO_OBO.obo)
+    <store> : file name to save the compiled store
+
+Examples:
+    ./sboStore.py SBO_XML.xml SBO.store
+    Parses the SBO XML export once, precomputes the ancestor closure of every
+    term and saves the result to SBO.store. The store can then be used by
+    expressionMapper.py with the -sbo parameter instead of the webservice.
+
+Only the XML export contains the MathML of rate laws; the OBO export can be
+used for term definitions and the hierarchy.
+"""
+
+import sys
+import re
+import cPickle as pickle
+from xml.etree.ElementTree import iterparse, tostring
+from xml.sax.saxutils import escape
+
+
+class SBOStore:
+    """
+    Local SBO term store that answers the same queries as the SBO webservice,
+    getStringTermById() and isChildOf(), without any network round trip.
+    """
+    magic = "SBOStore"
+    version = 1
+
+    def __init__(self, fname=None):
+        """
+        Initialises an empty store, or loads it from a file name if given. The
+        file can either be a store saved before or an SBO XML/OBO export.
+        """
+        self.sbons = "{http://www.biomodels.net/sbo}"
+        # SBO Id -> XML string of the term, in the format the webservice returns
+        self.terms = {}
+        # SBO Id -> set of parents, and the closure of all ancestors
+        self.parents = {}
+        self.ancestors = {}
+        if fname:
+            self.load(fname)
+
+    def load(self, fname):
+        """ Loads a compiled store, or parses an SBO export if it is none """
+        f = open(fname, "rb")
+        if f.read(1) != "\x80": # binary pickle protocol marker
+            return self.parse(fname)
+        f.seek(0)
+        header, self.terms, self.ancestors = pickle.load(f)
+        if header != (self.magic, self.version):
+            raise ValueError("unknown SBO store version: " + str(header))
+
+    def save(self, fname):
+        """ Saves the terms and the ancestor closure to the given file name """
+        pickle.dump(((self.magic, self.version), self.terms, self.ancestors), \
+            open(fname, "wb"), pickle.HIGHEST_PROTOCOL)
+
+    def parse(self, fname):
+        """
+        Parses an SBO export into the store and computes the ancestor closure.
+
+        Takes:
+        fname -- the file name of the SBO XML or OBO export
+        """
+        self.terms, self.parents = {}, {}
+        if fname.endswith(".obo"):
+            self._parseOBO(fname)
+        else:
+            self._parseXML(fname)
+        self.ancestors = {}
+        for id in self.parents:
+            self._getAncestors(id, set())
+        del self.parents
+
+    def _parseXML(self, fname):
+        """ Reads the Term elements of the SBO XML export one at a time """
+        for event, elm in iterparse(fname):
+            if elm.tag.split("}")[-1] != "Term":
+                continue
+            id = self._toInt(elm.find(self.sbons + "id").text)
+            self.terms[id] = tostring(elm)
+            self.parents[id] = set([self._toInt(p.text) for p in elm.findall(self.sbons + "is_a")])
+            elm.clear()
+
+    def _parseOBO(self, fname):
+        """ Reads the [Term] stanzas of the SBO OBO export """
+        def addTerm(stanza):
+            if "id" in stanza:
+                id = self._toInt(stanza["id"][0])
+                self.terms[id] = self._makeTerm(stanza)
+                self.parents[id] = set([self._toInt(p) for p in stanza.get("is_a", [])])
+
+        stanza = None
+        for line in open(fname):
+            line = line.strip()
+            if line.startswith("["):
+                if stanza:
+                    addTerm(stanza)
+                stanza = {} if line == "[Term]" else None
+            elif stanza is not None and ":" in line:
+                key, value = line.split(":", 1)
+                stanza.setdefault(key, []).append(value.split(" ! ")[0].strip())
+        if stanza:
+            addTerm(stanza)
+
+    def _makeTerm(self, stanza):
+        """ Constructs the webservice XML of a term from an OBO stanza """
+        defstr = re.search('(?<=^")(\\\\.|[^"])*', stanza.get("def", [""])[0])
+        return '<Term xmlns="%s"><id>%s</id><name>%s</name><def><defstr>%s</defstr></def></Term>' % \
+            (self.sbons[1:-1], escape(stanza["id"][0]), escape(stanza.get("name", [""])[0]), \
+            escape(defstr.group(0).replace('\\"', '"') if defstr else ""))
+
+    def _getAncestors(self, id, visiting):
+        """ Computes the set of all ancestors of a term, memoized """
+        if id not in self.ancestors:
+            visiting.add(id)
+            closure = set()
+            for parent in self.parents.get(id, ()):
+                closure.add(parent)
+                if parent not in visiting:
+                    closure |= self._getAncestors(parent, visiting)
+            self.ancestors[id] = frozenset(closure)
+            visiting.discard(id)
+        return self.ancestors[id]
+
+    def _toInt(self, id):
+        """ Converts an Id like SBO:0000031 to the integer 31 """
+        return int(re.search("[0-9]+$", str(id).strip()).group(0))
+
+    def getStringTermById(self, id):
+        """ Returns the XML string of a term, like the webservice method of the same name """
+        try:
+            return self.terms[self._toInt(id)]
+        except KeyError:
+            raise KeyError("SBO term not in store: " + str(id))
+
+    def isChildOf(self, child, parent):
+        """ Returns if parent is an ancestor of child, like the webservice method of the same name """
+        return self._toInt(parent) in self.ancestors.get(self._toInt(child), ())
+
+
+if __name__ == "__main__":
+    """
+    Makes the store compilation accessible to the command-line.
+    """
+    try:
+        dump, out = sys.argv[1:3]
+    except ValueError:
+        print __doc__
+        sys.exit(1)
+
+    store = SBOStore()
+    store.parse(dump)
+    store.save(out)
+    print "Saved", len(store.terms), "SBO terms to", out
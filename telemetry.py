@@ -0,0 +1,184 @@
+#!/usr/bin/env python2.7
+#
+# Telemetry records timing, memory use and warnings of the curation stages.
+# - written by Michael Schubert, EMBL-EBI, 2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Usage: ./telemetry.py [-top <n>] <trace> [<trace> ...]
+    <trace>  : trace file written by the curation scripts
+    -top     : number of models and stages to list, default 10
+
+Examples:
+    CURATION_TRACE=$PWD/trace.json make schedule
+    ./telemetry.py trace.json
+    Runs the curation with all scripts appending one JSON object per stage,
+    warning and matched reaction to trace.json, then lists the slowest
+    models and stages with their CPU time, peak memory and warnings.
+
+If the environment variable CURATION_TRACE is not set, nothing is recorded
+and warnings are only printed.
+"""
+
+import sys
+import os
+import time
+import json
+import resource
+
+# environment variable with the file name to append trace records to
+TRACE_VARIABLE = "CURATION_TRACE"
+
+# stages that are currently running in this process, innermost last
+openStages = []
+
+
+def record(event, **fields):
+    """
+    Appends a record to the trace file, if one is set
+
+    Takes:
+    event -- the type of record, e.g. "stage" or "warning"
+    fields -- the values to record
+    """
+    fname = os.environ.get(TRACE_VARIABLE)
+    if not fname:
+        return
+    fields.update(event=event, pid=os.getpid(), time=time.time())
+    if openStages:
+        fields.setdefault("stage", openStages[-1].name)
+        fields.setdefault("model", openStages[-1].model)
+    # one write to a file opened for appending, so that records of processes that run
+    # at the same time are not mixed up
+    fd = os.open(fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    try:
+        os.write(fd, json.dumps(fields, sort_keys=True) + "\n")
+    finally:
+        os.close(fd)
+
+
+def warn(*args, **kwargs):
+    """
+    Prints a warning like print "*** WARN: ***", *args, and records it with the stage
+    that is running. Use echo=False to only record it.
+    """
+    message = " ".join([str(arg) for arg in args])
+    if kwargs.get("echo", True):
+        print "*** WARN: ***", message
+    if openStages:
+        openStages[-1].warnings.append(message)
+    else:
+        record("warning", message=message)
+
+
+def peakRSS():
+    """ Returns the peak resident memory of this process so far in MB """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class Stage:
+    """
+    Context manager that records the wall and CPU time of a stage, the peak memory of the
+    process at its end, and the warnings given during it.
+
+    Takes:
+    name -- the stage name, e.g. "cleanup"
+    model -- the model file the stage works on
+    fields -- further values to record; more can be added to the fields attribute
+    """
+    def __init__(self, name, model=None, **fields):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.warnings = []
+
+    def __enter__(self):
+        openStages.append(self)
+        self.start = time.time()
+        self.startCPU = sum(os.times()[:2])
+        return self
+
+    def __exit__(self, type, value, traceback):
+        openStages.remove(self)
+        record("stage", stage=self.name, model=self.model, wall=time.time() - self.start, \
+            cpu=sum(os.times()[:2]) - self.startCPU, peakRSS=peakRSS(), \
+            warnings=self.warnings, failed=type is not None, **self.fields)
+        return False
+
+
+def readTraces(fnames):
+    """ Returns all records of the given trace files """
+    records = []
+    for fname in fnames:
+        for line in open(fname):
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+def summarize(records, top=10):
+    """ Prints the slowest models, stages and reactions with their totals """
+    stages = [r for r in records if r["event"] == "stage"]
+    byModel, byStage = {}, {}
+    for r in stages:
+        model = byModel.setdefault(r.get("model"), [0.0, 0.0, 0, 0.0])
+        stage = byStage.setdefault(r["stage"], [0.0, 0.0, 0, 0.0, 0])
+        for totals in (model, stage):
+            totals[0] += r["wall"]
+            totals[1] += r["cpu"]
+            totals[2] += len(r["warnings"])
+            totals[3] = max(totals[3], r["peakRSS"])
+        stage[4] += 1
+
+    print "%d stage runs of %d models" % (len(stages), len(byModel))
+    print
+    print "Slowest models:"
+    print "  %10s %10s %8s %9s  %s" % ("wall (s)", "cpu (s)", "warnings", "peak (MB)", "model")
+    for model, (wall, cpu, warnings, rss) in sorted(byModel.items(), key=lambda i: -i[1][0])[:top]:
+        print "  %10.3f %10.3f %8d %9.1f  %s" % (wall, cpu, warnings, rss, model)
+    print
+    print "Slowest stages:"
+    print "  %10s %10s %8s %9s %6s  %s" % ("wall (s)", "cpu (s)", "warnings", "peak (MB)", "runs", "stage")
+    for name, (wall, cpu, warnings, rss, runs) in sorted(byStage.items(), key=lambda i: -i[1][0])[:top]:
+        print "  %10.3f %10.3f %8d %9.1f %6d  %s" % (wall, cpu, warnings, rss, runs, name)
+    print
+    print "Slowest single stage runs:"
+    for r in sorted(stages, key=lambda r: -r["wall"])[:top]:
+        print "  %10.3f  %s %s" % (r["wall"], r["stage"], r.get("model"))
+
+    matches = [r for r in records if r["event"] == "match"]
+    if matches:
+        print
+        print "Slowest reactions to match with SBO rate laws:"
+        for r in sorted(matches, key=lambda r: -r["seconds"])[:top]:
+            print "  %10.3f  %s %s%s" % (r["seconds"], r.get("model"), r["reaction"], \
+                "" if r["matched"] else " (not matched)")
+
+
+if __name__ == "__main__":
+    """
+    Makes the summary report accessible to the command-line.
+    """
+    try:
+        args = sys.argv[1:]
+        top = 10
+        if args[0] == "-top":
+            top = int(args[1])
+            args = args[2:]
+        assert args
+    except Exception:
+        print __doc__
+        sys.exit(1)
+
+    summarize(readTraces(args), top)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python2.7
+#
+# ThrombinMetrics computes summary metrics of thrombin generation curves.
+# - written by Michael Schubert, EMBL-EBI, 2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Usage: ./thrombinMetrics.py -param value ... <spec|dir> [<spec|dir> ...]
+    <spec>      : JSON figure specification, as for figureRunner.py
+    <dir>       : directory to search for figures.json files, including its
+                  subdirectories
+    -y <expr>   : thrombin as expression of the simulated species, default
+                  "IIa + 1.2 * mIIa"
+    -lag <c>    : thrombin concentration that ends the lag time, default 1/6
+                  of the peak height of each curve
+    -clot <c>   : integral of thrombin over time that the clotting time is
+                  reached at, default none
+    -j <n>      : number of processes to simulate with, default 1
+    -cache <dir>: directory of the simulation cache of figureRunner.py
+
+Examples:
+    ./thrombinMetrics.py -j 4 -cache .cache Hockin2002 Jones1994
+    Simulates the scenarios of the figures of both models in one batch, and
+    prints lag time, time to peak, peak height and endogenous thrombin
+    potential of the total thrombin of each.
+
+All functions take time points as array of shape (t,) or (n, t) and the
+concentrations of n curves as array of shape (n, t), and return arrays of
+shape (n,), with NaN where a curve never reaches a threshold.
+"""
+
+import sys
+import os
+import numpy as np
+from figureRunner import evaluate, findSpecs, loadFigures, scenarioKey, collectScenarios, \
+    simulateAll, SimulationCache
+
+# fraction of the peak height that ends the lag time if no concentration is given,
+# as in the calibrated automated thrombogram
+lagFraction = 1 / 6.0
+
+
+def _batch(t, y):
+    """ Returns time points and concentrations as float arrays of the same shape (n, t) """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    return np.broadcast_to(np.asarray(t, dtype=float), y.shape), y
+
+
+def firstCrossing(t, y, threshold):
+    """
+    Returns the time at which each curve first reaches its threshold, interpolated
+    linearly between the time points, or NaN if it does not
+
+    Takes:
+    t -- time points, shape (t,) or (n, t)
+    y -- the curves, shape (n, t)
+    threshold -- one value for all curves, or one for each, shape (n,)
+    """
+    t, y = _batch(t, y)
+    threshold = np.broadcast_to(np.asarray(threshold, dtype=float), y.shape[:1])
+    rows = np.arange(len(y))
+    with np.errstate(invalid="ignore"): # NaN is never above
+        above = y >= threshold[:, None]
+    after = np.argmax(above, axis=1) # first point above, 0 if there is none
+    before = np.maximum(after - 1, 0)
+    y0, y1 = y[rows, before], y[rows, after]
+    t0, t1 = t[rows, before], t[rows, after]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(y1 > y0, (threshold - y0) / (y1 - y0), 0)
+    return np.where(above[rows, after], t0 + frac * (t1 - t0), np.nan)
+
+
+def peakHeight(t, y):
+    """ Returns the maximum concentration of each curve """
+    t, y = _batch(t, y)
+    return y.max(axis=1)
+
+
+def timeToPeak(t, y):
+    """ Returns the time at which each curve reaches its maximum """
+    t, y = _batch(t, y)
+    # argmax gives the first NaN, so a curve without a maximum has no time either
+    return np.where(np.isnan(peakHeight(t, y)), np.nan, t[np.arange(len(y)), np.argmax(y, axis=1)])
+
+
+def lagTime(t, y, threshold=None):
+    """
+    Returns the time until each curve reaches a thrombin concentration, by default
+    the fraction lagFraction of its peak height; NaN for curves that never rise above
+    their first value, as there is no thrombin burst to end the lag
+    """
+    t, y = _batch(t, y)
+    if threshold is None:
+        threshold = lagFraction * peakHeight(t, y)
+    return np.where(peakHeight(t, y) > y[:, 0], firstCrossing(t, y, threshold), np.nan)
+
+
+def cumulativeIntegral(t, y):
+    """ Returns the integral of each curve from the first time point on, by the trapezoidal rule """
+    t, y = _batch(t, y)
+    steps = 0.5 * (y[:, 1:] + y[:, :-1]) * np.diff(t, axis=1)
+    return np.concatenate([np.zeros((len(y), 1)), np.cumsum(steps, axis=1)], axis=1)
+
+
+def endogenousThrombinPotential(t, y):
+    """ Returns the area under each curve, by the trapezoidal rule """
+    t, y = _batch(t, y)
+    return np.trapz(y, t, axis=1)
+
+
+def clottingTime(t, y, threshold):
+    """
+    Returns the time at which the integral of each curve reaches a threshold, e.g. the
+    integral of fibrin reaching 1.5e3 nmol/l*s as in Wajima2009
+    """
+    return firstCrossing(t, cumulativeIntegral(t, y), threshold)
+
+
+def metrics(t, y, lagThreshold=None, clotThreshold=None):
+    """
+    Returns a dict of metric name -> array of shape (n,) for a batch of thrombin curves;
+    the clotting time only if its threshold is given
+    """
+    result = {"lag time" : lagTime(t, y, lagThreshold), "time to peak" : timeToPeak(t, y), \
+        "peak height" : peakHeight(t, y), "ETP" : endogenousThrombinPotential(t, y)}
+    if clotThreshold is not None:
+        result["clotting time"] = clottingTime(t, y, clotThreshold)
+    return result
+
+
+if __name__ == "__main__":
+    """
+    Makes the metrics of the figure scenarios accessible to the command-line.
+    """
+    try:
+        args = sys.argv[1:]
+        options = {"-y" : "IIa + 1.2 * mIIa", "-lag" : None, "-clot" : None, "-j" : "1", "-cache" : None}
+        while args and args[0] in options:
+            options[args[0]] = args[1]
+            args = args[2:]
+        lag, clot = [float(options[o]) if options[o] else None for o in ("-lag", "-clot")]
+        processes = int(options["-j"])
+        specs = findSpecs(args)
+        assert specs
+    except Exception:
+        print __doc__
+        sys.exit(1)
+
+    figures = loadFigures(specs)
+    cache = SimulationCache(options["-cache"]) if options["-cache"] else None
+    results = simulateAll(collectScenarios(figures), cache, processes)
+
+    # distinct scenarios with their labels, batched by model and time points
+    batches, seen = {}, set()
+    for figure in figures:
+        for axes in figure["axes"]:
+            for scenario in axes["scenarios"]:
+                key = (figure["model"], scenarioKey(scenario))
+                if key in seen or key not in results:
+                    continue
+                seen.add(key)
+                data = results[key]
+                batch = batches.setdefault((figure["model"], data["Time"].tobytes()), (data["Time"], [], []))
+                batch[1].append(scenario.get("label") or "")
+                batch[2].append(evaluate(options["-y"], data))
+
+    names = ["lag time", "time to peak", "peak height", "ETP"] + (["clotting time"] if clot is not None else [])
+    print "%-30s %-12s" % ("model", "scenario") + "".join(["%14s" % name for name in names])
+    for (model, grid), (t, labels, curves) in sorted(batches.items()):
+        values = metrics(t, np.array(curves), lag, clot)
+        for i, label in enumerate(labels):
+            print "%-30s %-12s" % (os.path.basename(model), label) + "".join(["%14.4g" % values[name][i] for name in names])
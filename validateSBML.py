@@ -5,7 +5,7 @@
 ## @author  Akiya Jouraku (translated from libSBML C++ examples)
 ## @author  Ben Bornstein
 ## @author  Michael Hucka
-## 
+##
 ## $Id: validateSBML.py 8854 2009-01-15 20:42:00Z ajouraku $
 ##
 ## This file is part of libSBML.  Please visit http://sbml.org for more
@@ -15,160 +15,352 @@
 import sys
 import os.path
 import time
+import json
+import hashlib
 import libsbml
+from multiprocessing import Pool
+from xml.sax.saxutils import escape, quoteattr
+from telemetry import Stage
+
+# consistency check categories, roughly from the cheapest to the most expensive
+checkCategories = [("identifier",     libsbml.LIBSBML_CAT_IDENTIFIER_CONSISTENCY),
+                   ("general",        libsbml.LIBSBML_CAT_GENERAL_CONSISTENCY),
+                   ("sbo",            libsbml.LIBSBML_CAT_SBO_CONSISTENCY),
+                   ("mathml",         libsbml.LIBSBML_CAT_MATHML_CONSISTENCY),
+                   ("practice",       libsbml.LIBSBML_CAT_MODELING_PRACTICE),
+                   ("units",          libsbml.LIBSBML_CAT_UNITS_CONSISTENCY),
+                   ("overdetermined", libsbml.LIBSBML_CAT_OVERDETERMINED_MODEL)]
+# categories not checked in tiered mode if the others found errors
+expensiveCategories = ("units", "overdetermined")
 
 class validateSBML:
-  def __init__(self, ucheck):
+  def __init__(self, ucheck, categories=None, tiered=False):
     self.reader    = libsbml.SBMLReader()
     self.ucheck    = ucheck
     self.numinvalid = 0
+    self.categories = [name for name, cat in checkCategories
+                       if (categories is None or name in categories) and (ucheck or name != "units")]
+    self.tiered    = tiered
 
   def validate(self, file):
-    if not os.path.exists(file):
-      print "[Error] %s : No such file." % (infile)
+    result = self.check(file)
+    if not result["valid"]:
       self.numinvalid += 1
-      return
-
-    start    = time.time()
-    sbmlDoc  = libsbml.readSBML(file)
-    stop     = time.time()
-    timeRead = (stop - start)*1000
-    errors   = sbmlDoc.getNumErrors()
-    
-    seriousErrors = False
-
-    numReadErr  = 0
-    numReadWarn = 0
-    errMsgRead  = ""
-
-    if errors > 0:
-      
-      for i in range(errors):
-        severity = sbmlDoc.getError(i).getSeverity()
-        if (severity == libsbml.LIBSBML_SEV_ERROR) or (severity == libsbml.LIBSBML_SEV_FATAL):
-          seriousErrors = True
-          numReadErr += 1
-        else:
-          numReadWarn += 1
-
-        oss = libsbml.ostringstream()
-        sbmlDoc.printErrors(oss)
-        errMsgRead = oss.str()
+    printResult(result)
+
+  def check(self, file):
+    """
+    Reads and checks one file, returns a dict with the timings and all errors
+    """
+    result = {"filename" : file, "size" : 0, "readTime" : 0.0, "checkTime" : None,
+              "categoryTimes" : {}, "skippedCategories" : [], "valid" : False, "errors" : []}
+    if not os.path.exists(file):
+      result["errors"].append({"phase" : "read", "severity" : "Fatal", "category" : "File",
+                               "id" : 0, "line" : 0, "message" : "No such file."})
+      return result
+    result["size"] = os.path.getsize(file)
+
+    with Stage("validate", file) as trace:
+      start    = time.time()
+      sbmlDoc  = libsbml.readSBML(file)
+      stop     = time.time()
+      result["readTime"] = (stop - start)*1000
+      self.checkDocument(sbmlDoc, result)
+      trace.fields["valid"] = result["valid"]
+    return result
+
+  def checkDocument(self, sbmlDoc, result=None):
+    """
+    Checks a document that is loaded already, where the errors in its log so far count as
+    read errors, returns the same dict as check()
+    """
+    if result is None:
+      result = {"filename" : None, "size" : 0, "readTime" : 0.0, "checkTime" : None,
+                "categoryTimes" : {}, "skippedCategories" : [], "valid" : False, "errors" : []}
+
+    seriousErrors = collectErrors(sbmlDoc, 0, "read", result["errors"])
 
     # If serious errors are encountered while reading an SBML document, it
     # does not make sense to go on and do full consistency checking because
     # the model may be nonsense in the first place.
 
-    numCCErr  = 0
-    numCCWarn = 0
-    errMsgCC  = ""
-    skipCC    = False;
-    timeCC    = 0.0
-
     if seriousErrors:
-      skipCC = True;
-      errMsgRead += "Further consistency checking and validation aborted."
-      self.numinvalid += 1;    
-    else:
-      sbmlDoc.setConsistencyChecks(libsbml.LIBSBML_CAT_UNITS_CONSISTENCY, self.ucheck)
-      start    = time.time()
-      failures = sbmlDoc.checkConsistency()
-      stop     = time.time()
-      timeCC   = (stop - start)*1000
-  
- 
-      if failures > 0:
-
-        isinvalid = False;
-        for i in range(failures):
-          severity = sbmlDoc.getError(i).getSeverity()
-          if (severity == libsbml.LIBSBML_SEV_ERROR) or (severity == libsbml.LIBSBML_SEV_FATAL):
-            numCCErr += 1
-            isinvalid = True;
-          else:
-            numCCWarn += 1
-
-        if isinvalid:
-          self.numinvalid += 1;    
-
-        oss = libsbml.ostringstream()
-        sbmlDoc.printErrors(oss)
-        errMsgCC = oss.str()
-
-    #
-    # print results
-    #
-        
-    print "                 filename : %s" % (file)
-    print "         file size (byte) : %d" % (os.path.getsize(file))
-    print "           read time (ms) : %f" % (timeRead)
-
-    if not skipCC :
-      print "        c-check time (ms) : %f" % (timeCC)
-    else:
-      print "        c-check time (ms) : skipped"
+      return result
+
+    # Check one category at a time. The modeling practice checks for missing units
+    # are only done together with the unit checks, so they are repeated there and
+    # errors that were reported before are ignored.
+    result["checkTime"] = 0.0
+    seen = set()
+    for name, cat in checkCategories:
+      if name not in self.categories:
+        continue
+      if self.tiered and seriousErrors and name in expensiveCategories:
+        result["skippedCategories"].append(name)
+        continue
+      enabled = [name]
+      if name == "units" and "practice" in self.categories:
+        enabled.append("practice")
+      for other, otherCat in checkCategories:
+        sbmlDoc.setConsistencyChecks(otherCat, other in enabled)
+
+      # checkConsistency appends to the error log of the document
+      numErrors = sbmlDoc.getNumErrors()
+      start     = time.time()
+      sbmlDoc.checkConsistency()
+      stop      = time.time()
+      result["categoryTimes"][name] = (stop - start)*1000
+      result["checkTime"] += (stop - start)*1000
+      if collectErrors(sbmlDoc, numErrors, "consistency", result["errors"], seen):
+        seriousErrors = True
+
+    result["valid"] = not seriousErrors
+    return result
+
+
+def collectErrors(sbmlDoc, start, phase, errors, seen=None):
+  """
+  Appends the errors of a document from index start on to a list as dicts, returns
+  if any of them is an error or fatal. If a set is given as seen, errors with an id,
+  line, and message in it are skipped and the new ones added.
+  """
+  serious = False
+  for i in range(start, sbmlDoc.getNumErrors()):
+    error = sbmlDoc.getError(i)
+    if seen is not None:
+      key = (error.getErrorId(), error.getLine(), error.getMessage())
+      if key in seen:
+        continue
+      seen.add(key)
+    if error.getSeverity() in (libsbml.LIBSBML_SEV_ERROR, libsbml.LIBSBML_SEV_FATAL):
+      serious = True
+    errors.append({"phase" : phase, "severity" : error.getSeverityAsString(),
+                   "category" : error.getCategoryAsString(), "id" : error.getErrorId(),
+                   "line" : error.getLine(), "message" : error.getMessage().strip()})
+  return serious
+
+
+def isSerious(error):
+  return error["severity"] in ("Error", "Fatal")
+
+
+def countErrors(result, phase):
+  """ Returns the number of errors and warnings of a phase """
+  errors = [e for e in result["errors"] if e["phase"] == phase]
+  numErr = len([e for e in errors if isSerious(e)])
+  return numErr, len(errors) - numErr
+
+
+def validateFile(args):
+  """
+  Checks one file in a worker process, args is the tuple (file, config) with config
+  the arguments of validateSBML
+  """
+  file, config = args
+  return validateSBML(*config).check(file)
 
-    print "      validation error(s) : %d" % (numReadErr  + numCCErr)
-    if not skipCC :
-      print "    (consistency error(s)): %d" % (numCCErr)
-    else:
-      print "    (consistency error(s)): skipped"
 
-    print "    validation warning(s) : %d" % (numReadWarn + numCCWarn)
-    if not skipCC :
-      print "  (consistency warning(s)): %d" % (numCCWarn)
-    else:
-      print "  (consistency warning(s)): skipped"
+def validateFiles(files, config, processes=1, cache=None, force=False):
+  """
+  Checks a number of files, with a process pool if processes > 1, where config
+  is the tuple of (ucheck, categories, tiered) arguments of validateSBML
 
-#    if errMsgRead or errMsgCC: 
-#      print
-#      print "===== validation error/warning messages =====\n"
-#      if errMsgRead : 
-#        print errMsgRead
-#      if errMsgCC : 
-#        print "*** consistency check ***\n"
-#        print errMsgCC
+  If a cache file is given, the results of files whose content, libSBML version and
+  checks are the same as in a previous run are taken from it instead of checking the
+  files again, unless force is set.
+  """
+  stored = loadCache(cache) if cache else {}
+  keys = {}
+  jobs = []
+  for file in files:
+    if cache and os.path.exists(file):
+      keys[file] = cacheKey(file, config)
+      if keys[file] in stored and not force:
+        continue
+    jobs.append((file, config))
+
+  if processes > 1 and len(jobs) > 1:
+    pool = Pool(processes)
+    checked = pool.map(validateFile, jobs)
+    pool.close()
+    pool.join()
+  else:
+    checked = map(validateFile, jobs)
+  checked = dict([(r["filename"], r) for r in checked])
+
+  results = []
+  for file in files:
+    if file in checked:
+      result = checked[file]
+      if file in keys:
+        stored[keys[file]] = result
+    else:
+      result = dict(stored[keys[file]], filename=file, cached=True)
+    results.append(result)
+
+  if cache and checked:
+    try:
+      json.dump(stored, open(cache, "w"))
+    except IOError, e:
+      print >> sys.stderr, "Could not save validation cache:", e
+  return results
+
+
+def cacheKey(file, config):
+  """ Returns the key of a file in the validation cache """
+  validator = validateSBML(*config)
+  key = hashlib.sha1(open(file, "rb").read())
+  key.update(" libsbml %s categories %s tiered %s" % (libsbml.getLibSBMLDottedVersion(),
+                                                      ",".join(validator.categories), validator.tiered))
+  return key.hexdigest()
+
+
+def loadCache(cache):
+  """ Returns the stored results of a validation cache file, or an empty dict """
+  try:
+    return json.load(open(cache))
+  except (IOError, ValueError):
+    return {}
+
+
+def printResult(result, out=sys.stdout):
+  numReadErr, numReadWarn = countErrors(result, "read")
+  numCCErr, numCCWarn = countErrors(result, "consistency")
+  skipCC = result["checkTime"] is None
+
+  if [e for e in result["errors"] if e["category"] == "File"]:
+    print >> out, "[Error] %s : No such file." % (result["filename"])
+    return
+
+  print >> out, "                 filename : %s" % (result["filename"])
+  print >> out, "         file size (byte) : %d" % (result["size"])
+  print >> out, "           read time (ms) : %f" % (result["readTime"])
+
+  if not skipCC :
+    print >> out, "        c-check time (ms) : %f" % (result["checkTime"])
+    for name, cat in checkCategories:
+      if name in result["categoryTimes"]:
+        print >> out, "%25s : %f" % ("%s (ms)" % name, result["categoryTimes"][name])
+      elif name in result["skippedCategories"]:
+        print >> out, "%25s : skipped" % ("%s (ms)" % name)
+  else:
+    print >> out, "        c-check time (ms) : skipped"
+
+  print >> out, "      validation error(s) : %d" % (numReadErr  + numCCErr)
+  if not skipCC :
+    print >> out, "    (consistency error(s)): %d" % (numCCErr)
+  else:
+    print >> out, "    (consistency error(s)): skipped"
+
+  print >> out, "    validation warning(s) : %d" % (numReadWarn + numCCWarn)
+  if not skipCC :
+    print >> out, "  (consistency warning(s)): %d" % (numCCWarn)
+  else:
+    print >> out, "  (consistency warning(s)): skipped"
+
+
+def writeText(results, ucheck, out):
+  for result in results:
+    print >> out, "---------------------------------------------------------------------------"
+    printResult(result, out)
+
+  numinvalid = len([r for r in results if not r["valid"]])
+  print >> out, "---------------------------------------------------------------------------"
+  print >> out, "Validated %d files, %d valid files, %d invalid files" % \
+    (len(results), len(results) - numinvalid, numinvalid)
+  if not ucheck:
+    print >> out, "(Unit consistency checks skipped)"
+
+
+def writeJSON(results, ucheck, out):
+  json.dump({"libsbml" : libsbml.getLibSBMLDottedVersion(), "unitChecks" : ucheck,
+             "files" : results}, out, indent=1, sort_keys=True)
+  out.write("\n")
+
+
+def writeJUnit(results, ucheck, out):
+  """ Writes one test case per file, failed if the file is invalid """
+  numinvalid = len([r for r in results if not r["valid"]])
+  total = sum([r["readTime"] + (r["checkTime"] or 0.0) for r in results]) / 1000
+  out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+  out.write('<testsuite name="validateSBML" tests="%d" failures="%d" time="%.3f">\n' %
+            (len(results), numinvalid, total))
+  for r in results:
+    out.write('  <testcase classname="validateSBML" name=%s time="%.3f">\n' %
+              (quoteattr(r["filename"]), (r["readTime"] + (r["checkTime"] or 0.0)) / 1000))
+    serious = [e for e in r["errors"] if isSerious(e)]
+    if not r["valid"]:
+      text = "\n".join(["%(phase)s %(severity)s %(id)d (%(category)s) line %(line)d: %(message)s" % e
+                        for e in serious])
+      if isinstance(text, unicode):
+        text = text.encode("utf-8")
+      out.write('    <failure message="%d error(s)">%s</failure>\n' % (len(serious), escape(text)))
+    out.write('    <system-out>read time (ms): %f, c-check time (ms): %s, warning(s): %d</system-out>\n' %
+              (r["readTime"], "skipped" if r["checkTime"] is None else "%f" % r["checkTime"],
+               len(r["errors"]) - len(serious)))
+    out.write('  </testcase>\n')
+  out.write('</testsuite>\n')
 
 
 def main (args):
-  """usage: validateSBML.py [-u] inputfile1 [inputfile2 ...]
-  -u  skips unit consistency check
+  """usage: validateSBML.py [-u] [-c categories] [-tiered] [-j n] [-format text|json|junit] [-o outfile]
+                       [-cache file [-force]] inputfile1 [inputfile2 ...]
+  -u       skips unit consistency check
+  -c       comma-separated consistency check categories, default all of identifier,
+           general, sbo, mathml, practice, units, overdetermined
+  -tiered  skips the units and overdetermined checks if the others found errors
+  -j       number of processes to validate with, default 1
+  -format  report format, default text
+  -o       file to write the report to, default standard output
+  -cache   file to store results in and take them from for unchanged files
+  -force   checks all files again, even if they are in the cache
   """
-  if len(args) < 2:
-    print main.__doc__
-    sys.exit(1)
-  elif (len(args) == 1) and (args[1] == "-u"):
+  enableUnitCCheck = True
+  force = False
+  tiered = False
+  options = {"-j" : "1", "-format" : "text", "-o" : None, "-cache" : None, "-c" : None}
+  writers = {"text" : writeText, "json" : writeJSON, "junit" : writeJUnit}
+
+  files = []
+  try:
+    i = 1
+    while i < len(args):
+      if args[i] == "-u":
+        enableUnitCCheck = False
+      elif args[i] == "-force":
+        force = True
+      elif args[i] == "-tiered":
+        tiered = True
+      elif args[i] in options:
+        options[args[i]] = args[i+1]
+        i += 1
+      else:
+        files.append(args[i])
+      i += 1
+    processes = int(options["-j"])
+    writer = writers[options["-format"]]
+    categories = None
+    if options["-c"]:
+      categories = options["-c"].split(",")
+      if set(categories) - set([name for name, cat in checkCategories]):
+        raise ValueError("unknown category")
+  except (IndexError, ValueError, KeyError):
+    files = []
+
+  if not files:
     print main.__doc__
     sys.exit(1)
 
-  enableUnitCCheck = True
-
-  if args[1] == "-u":
-    enableUnitCCheck = False
-
-  validator = validateSBML(enableUnitCCheck)
-
-  fnum = 0
-
-  for i in range(1,len(args)):
-    if args[i] == "-u":
-      continue
-    print "---------------------------------------------------------------------------"
-    validator.validate(args[i])
-    fnum += 1
+  config = (enableUnitCCheck, categories, tiered)
+  results = validateFiles(files, config, processes, options["-cache"], force)
 
-  numinvalid = validator.numinvalid
+  out = open(options["-o"], "w") if options["-o"] else sys.stdout
+  writer(results, "units" in validateSBML(*config).categories, out)
+  if out is not sys.stdout:
+    out.close()
 
-  print "---------------------------------------------------------------------------"
-  print "Validated %d files, %d valid files, %d invalid files" % (fnum, fnum - numinvalid, numinvalid)
-  if not enableUnitCCheck:
-    print "(Unit consistency checks skipped)"
-
-  if numinvalid > 0:
+  if [r for r in results if not r["valid"]]:
     sys.exit(1)
 
 if __name__ == '__main__':
-  main(sys.argv)  
-
-
-
+  main(sys.argv)